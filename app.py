@@ -1,11 +1,23 @@
-import os
+import hashlib
+import hmac
 
-import redis
 from flask import Flask, request
 
-from fb_functions import send_menu, send_message, send_cart_menu
-from moltin_api import add_product_to_cart, get_product_by_id
-from moltin_api import remove_product_from_cart
+from cart_service import CartService
+from fb_functions import (
+    FBSender,
+    create_category_menu,
+    send_menu,
+    send_message,
+    send_cart_menu,
+)
+from menu_cache import MenuCache
+from metrics import InstrumentedRedis, observe_handler, register_cache, render_metrics
+from moltin_api import MoltinClient
+from request_memo import memo_scope
+from settings import get_settings
+from state_store import StateStore, StaleStateError
+from update_queue import ShardedQueue
 
 app = Flask(__name__)
 
@@ -15,7 +27,7 @@ def verify():
     При верификации вебхука у Facebook он отправит запрос на этот адрес. На него нужно ответить VERIFY_TOKEN.
     """
     if request.args.get("hub.mode") == "subscribe" and request.args.get("hub.challenge"):
-        if not request.args.get("hub.verify_token") == os.environ["VERIFY_TOKEN"]:
+        if not request.args.get("hub.verify_token") == get_settings().verify_token:
             return "Verification token mismatch", 403
         return request.args["hub.challenge"], 200
 
@@ -27,26 +39,24 @@ def handle_start(sender_id, message, app_config):
     return "MENU"
 
 
+def get_added_pizza_name(cart, product_id, moltin):
+    for item in cart.items:
+        if item.get('product_id') == product_id:
+            return item['name']
+
+    return moltin.get_product_by_id(product_id)['data']['name']
+
+
 def handle_menu(sender_id, message, app_config):
     if message['title'] == 'Добавить в корзину':
-        client_id = os.environ["CLIENT_ID"]
-        client_secret = os.environ["CLIENT_SECRET"]
-
         cart_id = f"facebookid_{sender_id}"
-        add_product_to_cart(
-            cart_id,
-            message['value'],
-            1,
-            client_id,
-            client_secret
-        )
+        cart = app_config['carts'].add(cart_id, message['value'], 1)
 
-        pizza = get_product_by_id(message['value'], client_id, client_secret)
-        pizza_name = pizza['data']['name']
+        pizza_name = get_added_pizza_name(cart, message['value'], app_config['moltin'])
         message_text = f"В корзину добавлена пицца {pizza_name}"
-        send_message(sender_id, message_text)
+        send_message(sender_id, message_text, app_config['sender'])
     elif message['value'] == 'cart':
-        send_cart_menu(sender_id, message)
+        send_cart_menu(sender_id, message, app_config)
         return 'CART'
     else:
         send_menu(sender_id, message, app_config)
@@ -55,45 +65,32 @@ def handle_menu(sender_id, message, app_config):
 
 
 def handle_cart(sender_id, message, app_config):
-    client_id = os.environ["CLIENT_ID"]
-    client_secret = os.environ["CLIENT_SECRET"]
-
     cart_id = f"facebookid_{sender_id}"
 
     if message['value'] == 'return':
         send_menu(sender_id, message, app_config)
         return 'MENU'
-    elif message['title'] == 'Добавить ещё одну':
-        add_product_to_cart(
-            cart_id,
-            message['value'],
-            1,
-            client_id,
-            client_secret
-        )
 
-        pizza = get_product_by_id(message['value'], client_id, client_secret)
-        pizza_name = pizza['data']['name']
-        message_text = f"В корзину добавлена пицца {pizza_name}"
-        send_message(sender_id, message_text)
-    elif message['title'] == 'Убрать из корзины':
-        remove_product_from_cart(
-            cart_id,
-            message['value'],
-            client_id,
-            client_secret
-        )
+    with app_config['sender'].batch() as batch:
+        if message['title'] == 'Добавить ещё одну':
+            cart = app_config['carts'].add(cart_id, message['value'], 1)
+
+            pizza_name = get_added_pizza_name(cart, message['value'], app_config['moltin'])
+            message_text = f"В корзину добавлена пицца {pizza_name}"
+            send_message(sender_id, message_text, sender=batch)
+        elif message['title'] == 'Убрать из корзины':
+            app_config['carts'].remove(cart_id, message['value'])
 
-        message_text = "Пицца удалена из корзины"
-        send_message(sender_id, message_text)
+            message_text = "Пицца удалена из корзины"
+            send_message(sender_id, message_text, sender=batch)
 
-    send_cart_menu(sender_id, message)
+        send_cart_menu(sender_id, message, app_config, sender=batch)
 
     return 'CART'
 
 
 def handle_users_reply(sender_id, message, app_config):
-    db = app_config['database']
+    states = app_config['states']
 
     states_functions = {
         'START': handle_start,
@@ -101,54 +98,179 @@ def handle_users_reply(sender_id, message, app_config):
         'CART': handle_cart,
     }
 
-    db_key = f"facebookid_{sender_id}"
-    recorded_state = db.get(db_key)
-    
-    if not recorded_state or recorded_state.decode("utf-8") not in states_functions.keys():
-        user_state = "START"
+    user_state = states.load(sender_id)
+
+    if user_state.state not in states_functions:
+        current_state = "START"
     else:
-        user_state = recorded_state.decode("utf-8")
-    
-    state_handler = states_functions[user_state]
-    next_state = state_handler(sender_id, message, app_config)
-    db.set(db_key, next_state)
+        current_state = user_state.state
 
+    state_handler = states_functions[current_state]
+    with observe_handler('facebook', current_state):
+        next_state = state_handler(sender_id, message, app_config)
 
-@app.route('/', methods=['POST'])
-def webhook():
-    if not app.config.get('database'):
-        app.config.update(
-            database=redis.Redis(
-                host=os.environ["REDIS_HOST"],
-                port=os.environ["REDIS_PORT"],
-                password=os.environ["REDIS_PASSWORD"],
+    try:
+        states.save(
+            sender_id,
+            next_state,
+            user_state.data,
+            version=user_state.version
+        )
+    except StaleStateError as err:
+        app.logger.warning(err)
+
+
+def get_app_config(config):
+    if not config.get('settings'):
+        config.update(settings=get_settings())
+
+    settings = config['settings']
+
+    if not config.get('database'):
+        config.update(
+            database=InstrumentedRedis(
+                host=settings.database_host,
+                port=settings.database_port,
+                password=settings.database_password,
+            )
+        )
+
+    if not config.get('sender'):
+        config.update(
+            sender=FBSender(
+                settings.page_access_token,
+                base_url=settings.graph_api_url,
+                pool_size=settings.fb_pool_size,
+            )
+        )
+
+    if not config.get('moltin'):
+        config.update(
+            moltin=MoltinClient(
+                settings.client_id,
+                settings.client_secret,
+                base_url=settings.moltin_api_url,
+                pool_size=settings.moltin_pool_size,
+                timeout=settings.moltin_timeout,
+                catalog_ttl=settings.catalog_ttl,
+                failure_threshold=settings.circuit_failure_threshold,
+                reset_timeout=settings.circuit_reset_timeout,
+                redis=config['database'],
+            )
+        )
+        register_cache('moltin_catalog', config['moltin'].catalog_cache.stats)
+        register_cache('moltin_images', config['moltin'].image_cache.stats)
+
+    if not config.get('carts'):
+        config.update(
+            carts=CartService(config['moltin'], ttl=settings.cart_ttl)
+        )
+        register_cache('facebook_carts', config['carts'].carts.stats)
+
+    if not config.get('menus'):
+        moltin = config['moltin']
+        config.update(
+            menus=MenuCache(
+                config['database'],
+                lambda category_id: create_category_menu(category_id, moltin),
+                ttl=settings.menu_ttl,
             )
         )
+        register_cache('facebook_menus', config['menus'].stats)
+
+    if not config.get('states'):
+        config.update(
+            states=StateStore(
+                config['database'],
+                'facebook_state_',
+                ttl=settings.state_ttl,
+            )
+        )
+
+    if not config.get('events'):
+        config.update(
+            events=ShardedQueue(
+                config['database'],
+                'fb_events',
+                shards=settings.fb_event_shards,
+            )
+        )
+
+    return config
+
+
+def is_valid_signature(body, signature):
+    app_secret = get_settings().fb_app_secret
+    if not app_secret:
+        return True
+
+    expected = hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest()
+
+    return hmac.compare_digest(f"sha256={expected}", signature or "")
+
+
+def parse_messaging_event(messaging_event):
+    if messaging_event.get("message", {}).get("text"):
+        return {
+            'type':  'message',
+            'title': 'Сообщение',
+            'value': messaging_event["message"]["text"]
+        }
+    elif messaging_event.get("postback"):
+        return {
+            'type':  'postback',
+            'title': messaging_event["postback"]["title"],
+            'value': messaging_event["postback"]["payload"]
+        }
+
+
+def handle_event(event, app_config):
+    with memo_scope(f"facebook {event['sender_id']}"):
+        handle_users_reply(event['sender_id'], event['message'], app_config)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    content, content_type = render_metrics()
+    return content, 200, {'Content-Type': content_type}
+
+
+@app.route('/', methods=['POST'])
+def webhook():
+    """
+    Событие только проверяется и кладётся в очередь, обрабатывает его fb_worker.py.
+    """
+    if not is_valid_signature(request.get_data(), request.headers.get("X-Hub-Signature-256")):
+        return "Invalid signature", 403
+
+    app_config = get_app_config(app.config)
+
+    data = request.get_json(silent=True) or {}
+    if data.get("object") != "page":
+        return "ok", 200
+
+    inline = app_config.get('FB_INLINE_EVENTS')
+
+    events = []
+    for entry in data.get("entry", []):
+        for messaging_event in entry.get("messaging", []):
+            message = parse_messaging_event(messaging_event)
+            if not message:
+                continue
+
+            sender_id = messaging_event["sender"]["id"]
+            event = {'sender_id': sender_id, 'message': message}
+
+            if inline:
+                handle_event(event, app_config)
+            else:
+                events.append((sender_id, event))
+
+    app_config['events'].push_many(events)
 
-    data = request.get_json()
-    if data["object"] == "page":
-        for entry in data["entry"]:
-            for messaging_event in entry["messaging"]:
-                sender_id = messaging_event["sender"]["id"]
-                recipient_id = messaging_event["recipient"]["id"]
-
-                if messaging_event.get("message"):
-                    message = {
-                        'type':  'message',
-                        'title': 'Сообщение',
-                        'value': messaging_event["message"]["text"]
-                    }
-                elif messaging_event.get("postback"):
-                    message = {
-                        'type':  'postback',
-                        'title': messaging_event["postback"]["title"],
-                        'value': messaging_event["postback"]["payload"]
-                    }
-                    
-                if message:
-                    handle_users_reply(sender_id, message, app.config)
     return "ok", 200
 
 
 if __name__ == '__main__':
+    app.config.update(FB_INLINE_EVENTS=True)
     app.run(debug=True)
@@ -0,0 +1,290 @@
+"""Задержка переходов между состояниями ботов на локальных заглушках API.
+
+Каждый пользователь проходит все состояния bot.py (START → HANDLE_MENU → …
+→ HANDLE_PAYMENT) и app.py (START/MENU/CART). Moltin, Graph API, Telegram и
+Яндекс-геокодер заменяются заглушками из benchmarks/stand_ins.py, а Redis
+нужен настоящий: состояния, меню и кэши пишутся в него. Не запускайте
+бенчмарк на Redis с боевыми данными.
+
+Запуск: python -m benchmarks.conversations --users 50
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import replace
+
+from telegram import Update
+
+from benchmarks.stand_ins import STAND_INS
+from settings import Settings
+
+FIRST_CHAT_ID = 900000000
+
+TELEGRAM_SCENARIO = (
+    ('START', 'HANDLE_MENU', 'command', '/start'),
+    ('HANDLE_MENU', 'HANDLE_CART', 'callback', 'cart'),
+    ('HANDLE_CART', 'HANDLE_MENU', 'callback', 'return'),
+    ('HANDLE_MENU', 'HANDLE_DESCRIPTION', 'callback', 'product-1'),
+    ('HANDLE_DESCRIPTION', 'HANDLE_DESCRIPTION', 'callback', 'product-1:1'),
+    ('HANDLE_DESCRIPTION', 'HANDLE_MENU', 'callback', 'return'),
+    ('HANDLE_MENU', 'HANDLE_DESCRIPTION', 'callback', 'product-2'),
+    ('HANDLE_DESCRIPTION', 'HANDLE_DESCRIPTION', 'callback', 'product-2:1'),
+    ('HANDLE_DESCRIPTION', 'HANDLE_CART', 'callback', 'cart'),
+    ('HANDLE_CART', 'HANDLE_CART', 'callback', 'item-product-2'),
+    ('HANDLE_CART', 'WAITING_GEO', 'callback', 'checkout'),
+    ('WAITING_GEO', 'WAITING_GEO', 'text', 'Несуществующая улица'),
+    ('WAITING_GEO', 'HANDLE_DELIVERY', 'text', 'Москва, Тверская улица, {user}'),
+    ('HANDLE_DELIVERY', 'HANDLE_PAYMENT', 'callback', 'delivery'),
+    ('HANDLE_PAYMENT', 'HANDLE_PAYMENT', 'callback', 'pay'),
+    ('HANDLE_PAYMENT', 'HANDLE_MENU', 'callback', 'return'),
+)
+
+FACEBOOK_SCENARIO = (
+    ('START', 'MENU', 'message', 'Сообщение', 'Привет'),
+    ('MENU', 'MENU', 'postback', 'Категория 0', 'category-0'),
+    ('MENU', 'MENU', 'postback', 'Добавить в корзину', 'product-0'),
+    ('MENU', 'CART', 'postback', 'Корзина', 'cart'),
+    ('CART', 'CART', 'postback', 'Добавить ещё одну', 'product-0'),
+    ('CART', 'CART', 'postback', 'Добавить ещё одну', 'product-4'),
+    ('CART', 'CART', 'postback', 'Убрать из корзины', 'item-product-4'),
+    ('CART', 'MENU', 'postback', 'К меню', 'return'),
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TransitionStats:
+
+    def __init__(self):
+        self.durations = []
+        self.errors = 0
+        self.calls = defaultdict(int)
+
+
+def get_percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0
+
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+
+    return values[min(rank, len(values) - 1)]
+
+
+def start_stand_ins(args):
+    stand_ins = {}
+
+    for name, stand_in_class in STAND_INS.items():
+        stand_ins[name] = stand_in_class(
+            latency=getattr(args, f'{name}_latency') / 1000,
+            failure_rate=getattr(args, f'{name}_failure_rate'),
+            seed=args.seed,
+        ).start()
+
+    return stand_ins
+
+
+def get_benchmark_settings(args, stand_ins):
+    return Settings(
+        client_id='benchmark',
+        client_secret='benchmark',
+        database_host=args.redis_host,
+        database_port=args.redis_port,
+        database_password=args.redis_password,
+        tg_token='123456789:benchmark-token',
+        apikey='benchmark',
+        payment_token='benchmark',
+        page_access_token='benchmark',
+        moltin_api_url=stand_ins['moltin'].url,
+        graph_api_url=stand_ins['graph'].url,
+        yandex_geocoder_url=f"{stand_ins['yandex'].url}/1.x",
+        tg_api_url=f"{stand_ins['telegram'].url}/bot",
+    )
+
+
+def measure_step(stats, stand_ins, label, run_step):
+    calls_before = {
+        name: stand_in.get_calls_count() for name, stand_in in stand_ins.items()
+    }
+
+    started_at = time.perf_counter()
+    try:
+        next_state = run_step()
+    except Exception:
+        logger.exception('Шаг %s завершился ошибкой', label)
+        next_state = None
+    duration = time.perf_counter() - started_at
+
+    transition = stats[label]
+    transition.durations.append(duration)
+    for name, stand_in in stand_ins.items():
+        transition.calls[name] += stand_in.get_calls_count() - calls_before[name]
+
+    return next_state
+
+
+def get_telegram_update(chat_id, update_id, kind, data):
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Benchmark'}
+    chat = {'id': chat_id, 'type': 'private'}
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': chat,
+        'from': user,
+        'text': data,
+    }
+
+    if kind == 'command':
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(data)}]
+
+    if kind == 'callback':
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': user,
+                'chat_instance': str(chat_id),
+                'data': data,
+                'message': {**message, 'text': 'Меню'},
+            },
+        }
+
+    return {'update_id': update_id, 'message': message}
+
+
+def run_telegram(settings, stand_ins, users):
+    from bot import create_updater
+
+    updater = create_updater(replace(settings, dispatch_mode='inline'))
+    dispatcher = updater.dispatcher
+    states = dispatcher.bot_data['states']
+    stats = defaultdict(TransitionStats)
+    update_id = 0
+
+    for user in range(users):
+        chat_id = FIRST_CHAT_ID + user
+        states.delete(chat_id)
+
+        for state, next_state, kind, data in TELEGRAM_SCENARIO:
+            update_id += 1
+            label = f'{state} → {next_state} ({data.format(user="N")})'
+            update = Update.de_json(
+                get_telegram_update(chat_id, update_id, kind, data.format(user=user + 1)),
+                updater.bot
+            )
+
+            def run_step():
+                dispatcher.process_update(update)
+                return states.load(chat_id).state
+
+            if measure_step(stats, stand_ins, label, run_step) != next_state:
+                stats[label].errors += 1
+                break
+
+        states.delete(chat_id)
+
+    return stats
+
+
+def run_facebook(settings, stand_ins, users):
+    from app import get_app_config, handle_event
+
+    app_config = get_app_config({'settings': settings})
+    states = app_config['states']
+    stats = defaultdict(TransitionStats)
+
+    for user in range(users):
+        sender_id = str(FIRST_CHAT_ID + user)
+        states.delete(sender_id)
+
+        for state, next_state, message_type, title, value in FACEBOOK_SCENARIO:
+            label = f'{state} → {next_state} ({title})'
+            event = {
+                'sender_id': sender_id,
+                'message': {'type': message_type, 'title': title, 'value': value},
+            }
+
+            def run_step():
+                handle_event(event, app_config)
+                return states.load(sender_id).state
+
+            if measure_step(stats, stand_ins, label, run_step) != next_state:
+                stats[label].errors += 1
+                break
+
+        states.delete(sender_id)
+
+    return stats
+
+
+def get_report(stats):
+    return {
+        label: {
+            'count': len(transition.durations),
+            'errors': transition.errors,
+            'p50_ms': get_percentile(transition.durations, 50) * 1000,
+            'p95_ms': get_percentile(transition.durations, 95) * 1000,
+            'p99_ms': get_percentile(transition.durations, 99) * 1000,
+            'calls': {
+                name: calls / len(transition.durations)
+                for name, calls in transition.calls.items()
+            },
+        }
+        for label, transition in stats.items()
+    }
+
+
+def print_report(title, report):
+    print(f'\n{title}')
+    print(f"{'переход':<58} {'n':>4} {'ошибок':>6} {'p50, мс':>8} {'p95, мс':>8} "
+          f"{'p99, мс':>8} {'moltin':>7} {'graph':>6} {'telegram':>8} {'yandex':>6}")
+
+    for label, row in report.items():
+        calls = row['calls']
+        print(f"{label:<58} {row['count']:>4} {row['errors']:>6} {row['p50_ms']:>8.1f} "
+              f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {calls.get('moltin', 0):>7.1f} "
+              f"{calls.get('graph', 0):>6.1f} {calls.get('telegram', 0):>8.1f} "
+              f"{calls.get('yandex', 0):>6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--frontends', nargs='+', choices=('telegram', 'facebook'),
+                        default=('telegram', 'facebook'))
+    parser.add_argument('--redis-host', default=os.environ.get('REDIS_HOST', 'localhost'))
+    parser.add_argument('--redis-port', type=int, default=int(os.environ.get('REDIS_PORT', 6379)))
+    parser.add_argument('--redis-password', default=os.environ.get('REDIS_PASSWORD'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='сохранить отчёт в файл')
+
+    for name in STAND_INS:
+        parser.add_argument(f'--{name}-latency', type=float, default=20, help='мс')
+        parser.add_argument(f'--{name}-failure-rate', type=float, default=0)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    stand_ins = start_stand_ins(args)
+    settings = get_benchmark_settings(args, stand_ins)
+    runners = {'telegram': run_telegram, 'facebook': run_facebook}
+
+    reports = {}
+    try:
+        for frontend in args.frontends:
+            reports[frontend] = get_report(runners[frontend](settings, stand_ins, args.users))
+            print_report(frontend, reports[frontend])
+    finally:
+        for stand_in in stand_ins.values():
+            stand_in.stop()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(reports, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+"""Вебхук facebook, который обрабатывает события сам, без очереди и fb_worker.py.
+
+Только для бенчмарков: при нескольких воркерах gunicorn события одного
+пользователя обрабатываются параллельно и не по порядку, а у каждого
+воркера своя копия корзин.
+"""
+from app import app
+
+app.config.update(FB_INLINE_EVENTS=True)
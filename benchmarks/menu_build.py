@@ -0,0 +1,79 @@
+"""Сборка меню Facebook (create_category_menu) на заглушке Moltin.
+
+Картинки товаров, которых нет ни в кэше, ни в ответе с товарами,
+MoltinClient.get_image_urls скачивает на пуле потоков размером с пул
+соединений. Бенчмарк сравнивает сборку с пулом из одного соединения, то
+есть запросы по очереди, и с пулом --pool-size.
+
+Обычно Moltin отдаёт картинки вместе с товарами (include=main_image), и
+меню собирается за два запроса. С --without-included-images заглушка их
+не отдаёт, и каждая картинка запрашивается отдельно.
+
+Запуск: python -m benchmarks.menu_build --without-included-images
+"""
+import argparse
+import time
+
+from benchmarks.stand_ins import MoltinStandIn
+from fb_functions import create_category_menu
+from moltin_api import MoltinClient
+
+
+def build_menu_once(stand_in, category_id, pool_size):
+    moltin = MoltinClient(
+        'client_id',
+        'client_secret',
+        base_url=stand_in.url,
+        pool_size=pool_size
+    )
+
+    try:
+        moltin.tokens.get_token()
+        calls_before = stand_in.get_calls_count()
+
+        started_at = time.perf_counter()
+        create_category_menu(category_id, moltin)
+
+        return time.perf_counter() - started_at, stand_in.get_calls_count() - calls_before
+    finally:
+        moltin.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--products', type=int, default=32,
+                        help='товаров всего, они делятся между 4 категориями')
+    parser.add_argument('--latency', type=float, default=80, help='мс')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--without-included-images', action='store_true',
+                        help='не отдавать картинки вместе с товарами')
+    args = parser.parse_args()
+
+    stand_in = MoltinStandIn(
+        products_count=args.products,
+        include_images=not args.without_included_images,
+        latency=args.latency / 1000,
+        seed=args.seed
+    ).start()
+
+    print(f"{'пул':>4} {'запросов':>9} {'меню, мс':>9}")
+
+    try:
+        for pool_size in (1, args.pool_size):
+            durations = []
+            for _ in range(args.rounds):
+                duration, calls = build_menu_once(stand_in, 'category-0', pool_size)
+                durations.append(duration)
+
+            print(f'{pool_size:>4} {calls:>9} {sum(durations) / len(durations) * 1000:>9.0f}')
+    finally:
+        stand_in.stop()
+
+
+if __name__ == '__main__':
+    main()
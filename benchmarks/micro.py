@@ -0,0 +1,237 @@
+"""Микробенчмарки чистых функций, которые вызываются на каждое сообщение.
+
+Сохранить результаты как базовые:  python -m benchmarks.micro --save
+Сравнить с сохранёнными:           python -m benchmarks.micro --compare
+
+Сравнение завершается с кодом 1, если какая-то функция стала медленнее
+больше чем на --threshold процентов.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+from itertools import cycle
+
+from benchmarks.nearest_pizzeria import generate_pizzerias
+from bot import (
+    get_cart,
+    get_delivery_options_keyboard,
+    get_menu_keyboard,
+    get_text_of_delivery,
+)
+from cart_service import Cart
+from fb_functions import create_menu, get_elements_for_cart
+from pizzerias import PizzeriaIndex
+
+BASELINE_PATH = os.path.join('.benchmarks', 'micro.json')
+CATALOG_SIZES = (8, 50, 200)
+CART_SIZES = (1, 10, 50)
+PIZZERIA_SIZES = (100, 1000, 10000)
+CATEGORIES_COUNT = 4
+
+
+class FixtureMoltin:
+    """Каталог в памяти с тем же интерфейсом, что у MoltinClient с тёплым кэшем."""
+
+    def __init__(self, products_count, rng):
+        self.categories = {'data': [
+            {'id': f'category-{number}', 'description': f'Категория {number}'}
+            for number in range(CATEGORIES_COUNT)
+        ]}
+        self.products = [
+            {
+                'id': f'{number:08x}-4c1d-4e7b-9b1a-{rng.getrandbits(48):012x}',
+                'name': f'Пицца {number}',
+                'description': 'Томатный соус, моцарелла, пепперони, орегано. ' * 2,
+                'price': [{'amount': rng.randrange(300, 900, 10), 'currency': 'RUB'}],
+                'relationships': {
+                    'main_image': {'data': {'type': 'main_image', 'id': f'image-{number}'}}
+                },
+                'category_id': f'category-{number % CATEGORIES_COUNT}',
+            }
+            for number in range(products_count)
+        ]
+
+    def get_products(self):
+        return {product['name']: product['id'] for product in self.products}
+
+    def get_all_categories(self):
+        return self.categories
+
+    def get_last_category(self):
+        return self.categories['data'][-1]['id']
+
+    def get_products_by_category_id(self, category_id):
+        return {'data': [
+            product for product in self.products
+            if product['category_id'] == category_id
+        ]}
+
+    def get_image_urls(self, image_ids):
+        return {
+            image_id: f'https://files-eu.epusercontent.com/{image_id}.jpg'
+            for image_id in image_ids
+        }
+
+
+class FixtureCarts:
+
+    def __init__(self, items_count, rng):
+        items = []
+        total = 0
+
+        for number in range(items_count):
+            quantity = rng.randint(1, 3)
+            amount = rng.randrange(300, 900, 10) * quantity
+            total += amount
+            items.append({
+                'id': f'item-{number}',
+                'product_id': f'product-{number}',
+                'name': f'Пицца {number}',
+                'description': 'Томатный соус, моцарелла, пепперони, орегано.',
+                'quantity': quantity,
+                'image': {'href': f'https://files-eu.epusercontent.com/image-{number}.jpg'},
+                'meta': {'display_price': {'with_tax': {
+                    'value': {'amount': amount, 'formatted': f'{amount:,}'},
+                }}},
+            })
+
+        self.cart = Cart(items, f'{total:,}')
+
+    def get(self, cart_id):
+        return self.cart
+
+
+def get_cases(rng):
+    distances = cycle(
+        rng.choice((0.3, 3, 12, 35, 120)) * rng.uniform(0.8, 1) for _ in range(100)
+    )
+
+    cases = {
+        'get_text_of_delivery': lambda: get_text_of_delivery(
+            next(distances),
+            'Москва, Тверская улица, 7'
+        ),
+        'get_delivery_options_keyboard': lambda: get_delivery_options_keyboard(
+            next(distances)
+        ),
+    }
+
+    for size in CATALOG_SIZES:
+        moltin = FixtureMoltin(size, rng)
+        message = {'type': 'postback', 'title': 'Категория 1', 'value': 'category-1'}
+
+        cases[f'get_menu_keyboard[{size}]'] = lambda moltin=moltin: get_menu_keyboard(moltin)
+        cases[f'create_menu[{size}]'] = (
+            lambda moltin=moltin, message=message: create_menu(message, moltin)
+        )
+
+    for size in CART_SIZES:
+        carts = FixtureCarts(size, rng)
+        message = {'type': 'postback', 'title': 'Корзина', 'value': 'cart'}
+
+        cases[f'get_cart[{size}]'] = lambda carts=carts: get_cart(carts, 'chat')
+        cases[f'get_elements_for_cart[{size}]'] = (
+            lambda carts=carts, message=message: get_elements_for_cart('sender', message, carts)
+        )
+
+    for size in PIZZERIA_SIZES:
+        index = PizzeriaIndex(generate_pizzerias(size, rng))
+        queries = cycle([
+            (rng.uniform(55.4, 56.1), rng.uniform(37.2, 38.0)) for _ in range(100)
+        ])
+
+        cases[f'nearest_pizzeria[{size}]'] = (
+            lambda index=index, queries=queries: index.nearest(next(queries))
+        )
+
+    return cases
+
+
+def measure(function, repeat):
+    timer = timeit.Timer(function)
+    loops, _ = timer.autorange()
+    timings = [duration / loops for duration in timer.repeat(repeat=repeat, number=loops)]
+
+    return {
+        'min_us': min(timings) * 1e6,
+        'median_us': statistics.median(timings) * 1e6,
+        'loops': loops,
+    }
+
+
+def run(cases, repeat, only=None):
+    results = {}
+
+    for name, function in cases.items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+
+        results[name] = measure(function, repeat)
+        print(f"{name:<36} {results[name]['min_us']:>12.1f} мкс", flush=True)
+
+    return results
+
+
+def compare(baseline, results, threshold):
+    print(f"\n{'функция':<36} {'было, мкс':>12} {'стало, мкс':>12} {'разница':>9}")
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline['results']:
+            print(f'{name:<36} {"—":>12} {result["min_us"]:>12.1f}')
+            continue
+
+        before = baseline['results'][name]['min_us']
+        change = (result['min_us'] - before) / before * 100
+        mark = ''
+        if change > threshold:
+            regressions.append(name)
+            mark = '  медленнее'
+
+        print(f"{name:<36} {before:>12.1f} {result['min_us']:>12.1f} {change:>+8.1f}%{mark}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--save', nargs='?', const=BASELINE_PATH, help='сохранить базовые результаты')
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, help='сравнить с базовыми')
+    parser.add_argument('--threshold', type=float, default=10, help='допустимое замедление, %%')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help='запустить только функции с такими подстроками в имени')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = run(get_cases(random.Random(args.seed)), args.repeat, args.only)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'results': results,
+            }, file, ensure_ascii=False, indent=2)
+        print(f'\nБазовые результаты сохранены в {args.save}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"\nМедленнее больше чем на {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Сравнение поиска ближайшей пиццерии: перебор geopy против PizzeriaIndex.
+
+Запуск: python -m benchmarks.nearest_pizzeria
+"""
+import argparse
+import random
+import time
+
+from geopy import distance
+
+from pizzerias import PizzeriaIndex
+
+SIZES = (100, 1000, 10000)
+
+
+def generate_pizzerias(count, rng):
+    return [
+        {
+            'id': f'pizzeria-{number}',
+            'address': f'Адрес {number}',
+            'latitude': rng.uniform(55.45, 56.05),
+            'longitude': rng.uniform(37.25, 37.95),
+            'deliveryman-id': number,
+        }
+        for number in range(count)
+    ]
+
+
+def find_nearest_by_loop(coords, pizzerias):
+    distances = [
+        (
+            distance.distance(
+                coords,
+                (pizzeria['latitude'], pizzeria['longitude'])
+            ).km,
+            pizzeria,
+        )
+        for pizzeria in pizzerias
+    ]
+
+    return min(distances, key=lambda pair: pair[0])
+
+
+def measure(function, queries):
+    started_at = time.perf_counter()
+    results = [function(coords) for coords in queries]
+
+    return (time.perf_counter() - started_at) / len(queries), results
+
+
+def run(sizes, queries_count, seed):
+    rng = random.Random(seed)
+
+    print(f"{'пиццерий':>10} {'перебор, мс':>12} {'индекс, мс':>11} "
+          f"{'построение, мс':>15} {'ускорение':>10}")
+
+    for size in sizes:
+        pizzerias = generate_pizzerias(size, rng)
+        queries = [
+            (rng.uniform(55.4, 56.1), rng.uniform(37.2, 38.0))
+            for _ in range(queries_count)
+        ]
+
+        started_at = time.perf_counter()
+        index = PizzeriaIndex(pizzerias)
+        build_time = time.perf_counter() - started_at
+
+        loop_time, loop_results = measure(
+            lambda coords: find_nearest_by_loop(coords, pizzerias),
+            queries
+        )
+        index_time, index_results = measure(
+            lambda coords: index.nearest(coords)[0],
+            queries
+        )
+
+        for expected, found in zip(loop_results, index_results):
+            assert expected[1]['id'] == found[1]['id'], 'Индекс нашёл не ту пиццерию'
+
+        print(f'{size:>10} {loop_time * 1000:>12.2f} {index_time * 1000:>11.3f} '
+              f'{build_time * 1000:>15.1f} {loop_time / index_time:>9.0f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    run(args.sizes, args.queries, args.seed)
+
+
+if __name__ == '__main__':
+    main()
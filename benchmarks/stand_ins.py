@@ -0,0 +1,397 @@
+"""Локальные заглушки Moltin, Graph API, Telegram Bot API и Яндекс-геокодера.
+
+Каждая заглушка — HTTP-сервер в отдельном потоке на свободном порту. Ответ
+задерживается на latency секунд (±50%), а с вероятностью failure_rate
+заглушка отвечает 503. Число запросов считается по маршрутам.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.stand_in.respond(self)
+
+    def do_POST(self):
+        self.server.stand_in.respond(self)
+
+    def do_PUT(self):
+        self.server.stand_in.respond(self)
+
+    def do_DELETE(self):
+        self.server.stand_in.respond(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer:
+
+    name = 'stand-in'
+
+    def __init__(self, latency=0, failure_rate=0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = Counter()
+        self.failures = Counter()
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name=f'{self.name}-stand-in',
+            daemon=True
+        )
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_calls_count(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+    def respond(self, request):
+        url = urlsplit(request.path)
+        length = int(request.headers.get('Content-Length') or 0)
+        raw_body = request.rfile.read(length) if length else b''
+
+        label, status, payload = self.route(
+            request.command,
+            url.path,
+            parse_qs(url.query),
+            parse_body(raw_body, request.headers.get('Content-Type', ''))
+        )
+
+        with self._lock:
+            self.calls[label] += 1
+            delay = self.latency * self._rng.uniform(0.5, 1.5)
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.failures[label] += 1
+
+        if delay:
+            time.sleep(delay)
+
+        if failed:
+            status, payload = 503, {'errors': [{'title': 'Injected failure'}]}
+
+        content = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(content)))
+        request.end_headers()
+        request.wfile.write(content)
+
+
+def parse_body(raw_body, content_type):
+    if not raw_body:
+        return {}
+
+    if 'json' in content_type:
+        return json.loads(raw_body)
+
+    return {
+        key: values[0]
+        for key, values in parse_qs(raw_body.decode()).items()
+    }
+
+
+def format_price(amount):
+    return f'{amount:,}'
+
+
+class MoltinStandIn(StandInServer):
+
+    name = 'moltin'
+
+    def __init__(
+        self,
+        products_count=8,
+        categories_count=4,
+        pizzerias_count=50,
+        include_images=True,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.include_images = include_images
+        self.categories = [
+            {
+                'id': f'category-{number}',
+                'name': f'category-{number}',
+                'description': f'Категория {number}',
+            }
+            for number in range(categories_count)
+        ]
+        self.products = {
+            f'product-{number}': {
+                'id': f'product-{number}',
+                'type': 'product',
+                'name': f'Пицца {number}',
+                'sku': f'pizza-{number}',
+                'description': f'Описание пиццы {number}',
+                'price': [{'amount': 400 + 50 * number, 'currency': 'RUB'}],
+                'category_id': self.categories[number % categories_count]['id'],
+                'relationships': {
+                    'main_image': {'data': {'type': 'main_image', 'id': f'image-{number}'}}
+                },
+            }
+            for number in range(products_count)
+        }
+
+        rng = random.Random(0)
+        self.pizzerias = [
+            {
+                'id': f'pizzeria-{number}',
+                'address': f'Москва, Пиццерийная улица, {number}',
+                'alias': f'Пиццерия {number}',
+                'latitude': rng.uniform(55.6, 55.9),
+                'longitude': rng.uniform(37.4, 37.8),
+                'deliveryman-id': 700000000 + number,
+            }
+            for number in range(pizzerias_count)
+        ]
+        self.carts = {}
+
+    def get_image(self, image_id):
+        return {
+            'id': image_id,
+            'type': 'main_image',
+            'link': {'href': f'https://images.example.com/{image_id}.jpg'},
+        }
+
+    def get_cart(self, cart_id):
+        cart = self.carts.setdefault(cart_id, {})
+        total = 0
+        items = []
+
+        for product_id, quantity in cart.items():
+            product = self.products[product_id]
+            amount = product['price'][0]['amount'] * quantity
+            total += amount
+            items.append({
+                'id': f'item-{product_id}',
+                'type': 'cart_item',
+                'product_id': product_id,
+                'name': product['name'],
+                'description': product['description'],
+                'quantity': quantity,
+                'image': {'href': self.get_image(
+                    product['relationships']['main_image']['data']['id']
+                )['link']['href']},
+                'meta': {'display_price': {'with_tax': {
+                    'value': {'amount': amount, 'formatted': format_price(amount)},
+                }}},
+            })
+
+        return {
+            'data': items,
+            'meta': {'display_price': {'with_tax': {
+                'amount': total,
+                'formatted': format_price(total),
+            }}},
+        }
+
+    def route(self, method, path, query, body):
+        if path == '/oauth/access_token':
+            return 'auth', 200, {'access_token': 'benchmark', 'expires_in': 3600}
+
+        if path == '/v2/categories':
+            return 'categories', 200, {'data': self.categories}
+
+        if path == '/v2/products':
+            products = list(self.products.values())
+            category_filter = re.search(r'category\.id,([^)]+)', query.get('filter', [''])[0])
+            if category_filter:
+                products = [
+                    product for product in products
+                    if product['category_id'] == category_filter.group(1)
+                ]
+
+            response_data = {'data': products}
+            if self.include_images and 'main_image' in query.get('include', []):
+                response_data['included'] = {'main_images': [
+                    self.get_image(product['relationships']['main_image']['data']['id'])
+                    for product in products
+                ]}
+
+            return 'products', 200, response_data
+
+        match = re.fullmatch(r'/v2/products/([^/]+)', path)
+        if match:
+            product = self.products.get(match.group(1))
+            if not product:
+                return 'product', 404, {'errors': [{'title': 'Not found'}]}
+
+            response_data = {'data': product}
+            if 'main_image' in query.get('include', []):
+                response_data['included'] = {'main_images': [
+                    self.get_image(product['relationships']['main_image']['data']['id'])
+                ]}
+
+            return 'product', 200, response_data
+
+        match = re.fullmatch(r'/v2/files/([^/]+)', path)
+        if match:
+            return 'file', 200, {'data': self.get_image(match.group(1))}
+
+        match = re.fullmatch(r'/v2/carts/([^/]+)/items(?:/([^/]+))?', path)
+        if match:
+            cart_id, item_id = match.groups()
+
+            with self._lock:
+                cart = self.carts.setdefault(cart_id, {})
+
+                if method == 'POST':
+                    product_id = body['data']['id']
+                    cart[product_id] = cart.get(product_id, 0) + body['data']['quantity']
+                elif method == 'DELETE':
+                    product_id = item_id.replace('item-', '', 1)
+                    if product_id not in cart:
+                        return 'cart', 404, {'errors': [{'title': 'Not found'}]}
+                    del cart[product_id]
+
+                return 'cart', 200, self.get_cart(cart_id)
+
+        if path == '/v2/flows/pizzeria/entries':
+            limit = int(query.get('page[limit]', ['100'])[0])
+            offset = int(query.get('page[offset]', ['0'])[0])
+
+            return 'pizzerias', 200, {
+                'data': self.pizzerias[offset:offset + limit],
+                'meta': {'results': {'total': len(self.pizzerias)}},
+            }
+
+        if path == '/v2/flows/customer-address/entries':
+            return 'customer_address', 201, {'data': body.get('data', {})}
+
+        return 'unknown', 404, {'errors': [{'title': 'Not found'}]}
+
+
+class GraphStandIn(StandInServer):
+
+    name = 'graph'
+
+    def route(self, method, path, query, body):
+        if path.endswith('/me/messages'):
+            recipient_id = body.get('recipient', {}).get('id')
+            return 'messages', 200, {
+                'recipient_id': recipient_id,
+                'message_id': f'mid.{time.monotonic_ns()}',
+            }
+
+        if 'batch' in body:
+            operations = json.loads(body['batch'])
+            return 'batch', 200, [
+                {'code': 200, 'body': json.dumps({'message_id': f'mid.{number}'})}
+                for number, _ in enumerate(operations)
+            ]
+
+        return 'unknown', 404, {'error': {'message': 'Unknown path'}}
+
+
+class TelegramStandIn(StandInServer):
+
+    name = 'telegram'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.message_ids = 0
+
+    def get_message(self, body, **fields):
+        with self._lock:
+            self.message_ids += 1
+            message_id = self.message_ids
+
+        chat_id = int(body.get('chat_id', 0))
+
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **fields,
+        }
+
+    def route(self, method, path, query, body):
+        api_method = path.rsplit('/', 1)[-1]
+
+        if api_method == 'getMe':
+            result = {
+                'id': 100000000,
+                'is_bot': True,
+                'first_name': 'Pizza',
+                'username': 'pizza_benchmark_bot',
+            }
+        elif api_method in ('answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+            result = True
+        elif api_method == 'sendPhoto':
+            file_id = f"photo-{zlib.crc32(str(body.get('photo')).encode())}"
+            result = self.get_message(body, photo=[{
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'width': 800,
+                'height': 600,
+            }])
+        elif api_method == 'sendLocation':
+            result = self.get_message(body, location={
+                'latitude': float(body.get('latitude', 0)),
+                'longitude': float(body.get('longitude', 0)),
+            })
+        elif api_method.startswith(('send', 'edit')):
+            result = self.get_message(body, text=body.get('text', ''))
+        else:
+            return api_method, 404, {'ok': False, 'description': 'Not Found'}
+
+        return api_method, 200, {'ok': True, 'result': result}
+
+
+class YandexStandIn(StandInServer):
+
+    name = 'yandex'
+
+    def route(self, method, path, query, body):
+        address = query.get('geocode', [''])[0]
+
+        if not address or 'несуществующ' in address.lower():
+            members = []
+        else:
+            rng = random.Random(address)
+            longitude = rng.uniform(37.4, 37.8)
+            latitude = rng.uniform(55.6, 55.9)
+            members = [{'GeoObject': {'Point': {'pos': f'{longitude} {latitude}'}}}]
+
+        return 'geocode', 200, {
+            'response': {'GeoObjectCollection': {'featureMember': members}}
+        }
+
+
+STAND_INS = {
+    'moltin': MoltinStandIn,
+    'graph': GraphStandIn,
+    'telegram': TelegramStandIn,
+    'yandex': YandexStandIn,
+}
@@ -0,0 +1,369 @@
+"""Нагрузка на вебхук facebook (app.webhook) событиями Messenger.
+
+События генерируются для множества sender_id или читаются из файла, по
+одному JSON на строку. Они отправляются с заданной частотой, а в отчёте
+приводятся пропускная способность, доля ошибок и перцентили задержки.
+
+Нагрузить уже запущенный вебхук:
+    python -m benchmarks.webhook_load --url http://127.0.0.1:5000/ --rate 200
+
+Подобрать число воркеров gunicorn:
+    python -m benchmarks.webhook_load --workers 1 2 4 8 --rate 100 --inline
+
+С --inline запускается benchmarks.inline_webhook:app, который обрабатывает
+события прямо в вебхуке на заглушках Moltin и Graph API. Без него запускается
+app:app, который только кладёт события в очередь Redis: заглушки не нужны, а
+ключи fb_events:* удаляются после каждого числа воркеров. Redis берётся из REDIS_HOST, REDIS_PORT и REDIS_PASSWORD — не запускайте
+нагрузку на боевой базе.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from redis import Redis
+
+from benchmarks.conversations import get_percentile
+from benchmarks.stand_ins import GraphStandIn, MoltinStandIn
+
+PAGE_ID = '100000000000000'
+QUEUE_NAME = 'fb_events'
+
+
+def get_messaging_event(sender_id, rng, products_count, categories_count):
+    event = {
+        'sender': {'id': sender_id},
+        'recipient': {'id': PAGE_ID},
+        'timestamp': int(time.time() * 1000),
+    }
+    kind = rng.choices(
+        ('text', 'category', 'add', 'cart', 'return', 'remove'),
+        weights=(20, 25, 25, 15, 10, 5)
+    )[0]
+    product_id = f'product-{rng.randrange(products_count)}'
+    category_number = rng.randrange(categories_count)
+
+    if kind == 'text':
+        event['message'] = {
+            'mid': f'm_{rng.getrandbits(64):x}',
+            'text': rng.choice(('Привет', 'Меню', 'Хочу пиццу', 'Здравствуйте')),
+        }
+        return event
+
+    postbacks = {
+        'category': (f'Категория {category_number}', f'category-{category_number}'),
+        'add': ('Добавить в корзину', product_id),
+        'cart': ('Корзина', 'cart'),
+        'return': ('К меню', 'return'),
+        'remove': ('Убрать из корзины', f'item-{product_id}'),
+    }
+    title, payload = postbacks[kind]
+    event['postback'] = {'title': title, 'payload': payload}
+
+    return event
+
+
+def generate_payloads(count, senders, seed, products_count=8, categories_count=4):
+    rng = random.Random(seed)
+    sender_ids = [str(5000000000000000 + number) for number in range(senders)]
+
+    return [
+        {
+            'object': 'page',
+            'entry': [{
+                'id': PAGE_ID,
+                'time': int(time.time() * 1000),
+                'messaging': [get_messaging_event(
+                    rng.choice(sender_ids),
+                    rng,
+                    products_count,
+                    categories_count
+                )],
+            }],
+        }
+        for _ in range(count)
+    ]
+
+
+def read_payloads(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def write_payloads(path, payloads):
+    with open(path, 'w') as file:
+        for payload in payloads:
+            file.write(json.dumps(payload, ensure_ascii=False) + '\n')
+
+
+class LoadClient:
+
+    def __init__(self, url, app_secret=None, timeout=10):
+        self.url = url
+        self.app_secret = app_secret
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get_session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def post(self, payload, scheduled_at):
+        body = json.dumps(payload).encode()
+        headers = {'Content-Type': 'application/json'}
+
+        if self.app_secret:
+            digest = hmac.new(self.app_secret.encode(), body, hashlib.sha256).hexdigest()
+            headers['X-Hub-Signature-256'] = f'sha256={digest}'
+
+        try:
+            response = self.get_session().post(
+                self.url,
+                data=body,
+                headers=headers,
+                timeout=self.timeout
+            )
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+
+        return time.perf_counter() - scheduled_at, ok
+
+
+def run_load(client, payloads, rate, concurrency):
+    """Отправляет события по расписанию, не дожидаясь ответов на прошлые.
+
+    Задержка считается от запланированного времени отправки, поэтому
+    ожидание свободного потока тоже в неё попадает.
+    """
+    futures = []
+    started_at = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for number, payload in enumerate(payloads):
+            scheduled_at = started_at + number / rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            futures.append(executor.submit(client.post, payload, scheduled_at))
+
+        results = [future.result() for future in futures]
+
+    duration = time.perf_counter() - started_at
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+
+    return {
+        'sent': len(results),
+        'duration_s': duration,
+        'throughput_rps': len(results) / duration,
+        'error_rate': errors / len(results) if results else 0,
+        'p50_ms': get_percentile(latencies, 50) * 1000,
+        'p95_ms': get_percentile(latencies, 95) * 1000,
+        'p99_ms': get_percentile(latencies, 99) * 1000,
+    }
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, port, env, app_spec='app:app'):
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn', app_spec,
+            '--workers', str(workers),
+            '--bind', f'127.0.0.1:{port}',
+            '--log-level', 'warning',
+        ],
+        env=env,
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn завершился с кодом {process.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError('gunicorn не запустился за 30 секунд')
+
+
+def get_gunicorn_env(args, stand_ins):
+    env = dict(
+        os.environ,
+        CLIENT_ID='benchmark',
+        CLIENT_SECRET='benchmark',
+        REDIS_HOST=args.redis_host,
+        REDIS_PORT=str(args.redis_port),
+        PAGE_ACCESS_TOKEN='benchmark',
+        VERIFY_TOKEN='benchmark',
+    )
+    if stand_ins:
+        env['MOLTIN_API_URL'] = stand_ins['moltin'].url
+        env['GRAPH_API_URL'] = stand_ins['graph'].url
+    if args.redis_password:
+        env['REDIS_PASSWORD'] = args.redis_password
+    if args.app_secret:
+        env['FB_APP_SECRET'] = args.app_secret
+
+    return env
+
+
+def print_result(label, result):
+    print(f"{label:>8} {result['sent']:>7} {result['throughput_rps']:>10.1f} "
+          f"{result['error_rate'] * 100:>9.2f} {result['p50_ms']:>8.1f} "
+          f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}", flush=True)
+
+
+def is_enough(result, args):
+    return (
+        result['throughput_rps'] >= args.rate * 0.95
+        and result['error_rate'] <= args.max_error_rate
+        and result['p99_ms'] <= args.p99_slo
+    )
+
+
+def start_stand_ins(args):
+    return {
+        'moltin': MoltinStandIn(
+            latency=args.moltin_latency / 1000,
+            failure_rate=args.failure_rate,
+            seed=args.seed
+        ).start(),
+        'graph': GraphStandIn(
+            latency=args.graph_latency / 1000,
+            failure_rate=args.failure_rate,
+            seed=args.seed
+        ).start(),
+    }
+
+
+def clear_queue(db):
+    """Удаляет события, которые app:app положил в очередь и никто не прочитал."""
+    keys = list(db.scan_iter(f'{QUEUE_NAME}:*'))
+    if keys:
+        db.delete(*keys)
+    return len(keys)
+
+
+def sweep_workers(args, payloads):
+    """Запускает gunicorn с каждым числом воркеров и нагружает его.
+
+    С --inline события обрабатываются в вебхуке на заглушках. Без него вебхук
+    только кладёт события в очередь, а её никто не читает, поэтому заглушки
+    не запускаются, а очередь очищается после каждого прогона, чтобы
+    следующий не начинал с чужого хвоста.
+    """
+    stand_ins = start_stand_ins(args) if args.inline else {}
+    db = None if args.inline else Redis(
+        host=args.redis_host,
+        port=args.redis_port,
+        password=args.redis_password
+    )
+    env = get_gunicorn_env(args, stand_ins)
+    app_spec = 'benchmarks.inline_webhook:app' if args.inline else 'app:app'
+    results = {}
+
+    try:
+        for workers in args.workers:
+            port = get_free_port()
+            process = start_gunicorn(workers, port, env, app_spec)
+            try:
+                client = LoadClient(f'http://127.0.0.1:{port}/', args.app_secret, args.timeout)
+                results[workers] = run_load(client, payloads, args.rate, args.concurrency)
+            finally:
+                process.terminate()
+                process.wait()
+                if db is not None:
+                    clear_queue(db)
+
+            print_result(workers, results[workers])
+    finally:
+        for stand_in in stand_ins.values():
+            stand_in.stop()
+
+    enough = [workers for workers, result in results.items() if is_enough(result, args)]
+    if enough:
+        print(f'\nДля {args.rate} событий в секунду хватает воркеров: {min(enough)}')
+    else:
+        print(f'\nНи одно число воркеров не выдержало {args.rate} событий в секунду')
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--url', help='адрес запущенного вебхука')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        help='запустить gunicorn с таким числом воркеров')
+    parser.add_argument('--inline', action='store_true',
+                        help='обрабатывать события в вебхуке, а не в очереди')
+    parser.add_argument('--rate', type=float, default=50, help='событий в секунду')
+    parser.add_argument('--duration', type=float, default=20, help='секунд')
+    parser.add_argument('--senders', type=int, default=5000)
+    parser.add_argument('--replay', help='файл с событиями, по одному JSON на строку')
+    parser.add_argument('--record', help='сохранить сгенерированные события в файл')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--app-secret', default=os.environ.get('FB_APP_SECRET'))
+    parser.add_argument('--moltin-latency', type=float, default=50, help='мс')
+    parser.add_argument('--graph-latency', type=float, default=50, help='мс')
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--p99-slo', type=float, default=1000, help='мс')
+    parser.add_argument('--redis-host', default=os.environ.get('REDIS_HOST', 'localhost'))
+    parser.add_argument('--redis-port', type=int, default=int(os.environ.get('REDIS_PORT', 6379)))
+    parser.add_argument('--redis-password', default=os.environ.get('REDIS_PASSWORD'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='сохранить отчёт в файл')
+    args = parser.parse_args()
+
+    if not args.url and not args.workers:
+        parser.error('нужен --url или --workers')
+
+    if args.replay:
+        payloads = read_payloads(args.replay)
+    else:
+        payloads = generate_payloads(int(args.rate * args.duration), args.senders, args.seed)
+
+    if args.record:
+        write_payloads(args.record, payloads)
+
+    print(f"{'воркеров':>8} {'событий':>7} {'событий/с':>10} {'ошибок, %':>9} "
+          f"{'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8}")
+
+    if args.workers:
+        report = sweep_workers(args, payloads)
+    else:
+        client = LoadClient(args.url, args.app_secret, args.timeout)
+        report = {'url': run_load(client, payloads, args.rate, args.concurrency)}
+        print_result('—', report['url'])
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,33 @@
 import logging
-import redis
+import signal
+import threading
 from textwrap import dedent
 
-from environs import Env
-from geopy import distance
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
+from prometheus_client import start_http_server
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, Update
+from telegram.error import BadRequest
 from telegram.ext import Filters, Updater
 from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler
 
-from moltin_api import add_product_to_cart, get_cart_and_full_price, remove_product_from_cart
-from moltin_api import create_customers_address, get_image_url, get_products, get_product_by_id
-from moltin_api import get_deliveryman_id_by_pizzeria_address, get_all_pizzerias
-from yandex_api import fetch_coordinates
+from cart_service import CartService
+from keyed_executor import KeyedExecutor
+from metrics import InstrumentedRedis, observe_handler, register_cache
+from moltin_api import MoltinClient
+from photo_cache import PhotoCache
+from pizzerias import PizzeriaSnapshot
+from request_memo import memo_scope
+from resilience import is_unavailable
+from settings import get_settings, reload_on_sighup
+from state_store import StateStore, StaleStateError
+from update_queue import ShardedQueue, consume
+from yandex_api import GeocoderCache
 
 _database = None
 logger = logging.getLogger(__name__)
 
 
-def get_menu_keyboard():
-    env = get_env()
-    products = get_products(env['client_id'], env['client_secret'])
+def get_menu_keyboard(moltin):
+    products = moltin.get_products()
 
     keyboard = [
         [InlineKeyboardButton(product_name, callback_data=product_id)]
@@ -32,9 +40,13 @@ def get_menu_keyboard():
     return keyboard
 
 
-def get_cart(cart_id):
-    env = get_env()
-    cart_items, full_price = get_cart_and_full_price(cart_id, env['client_id'], env['client_secret'])
+def get_cart(carts, cart_id):
+    cart = carts.get(cart_id)
+
+    return render_cart(cart.items, cart.full_price)
+
+
+def render_cart(cart_items, full_price):
     cart_items_display = [
         dedent(
             f"""\
@@ -133,11 +145,29 @@ def get_delivery_options_keyboard(min_distance):
     return options_keyboard
 
 
+def reply_product_photo(message, context, product_id, image_id, **kwargs):
+    photos = context.bot_data['photos']
+    file_id = photos.get(image_id)
+
+    if file_id:
+        try:
+            return message.reply_photo(file_id, **kwargs)
+        except BadRequest as err:
+            logger.warning('file_id картинки %s не подошёл: %s', image_id, err)
+            photos.forget(image_id)
+
+    image_url = context.bot_data['moltin'].get_image_url(image_id)
+    sent_message = message.reply_photo(image_url, **kwargs)
+    photos.remember(product_id, image_id, sent_message.photo[-1].file_id)
+
+    return sent_message
+
+
 def start(update, context):
-    keyboard = get_menu_keyboard()
+    keyboard = get_menu_keyboard(context.bot_data['moltin'])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text('Пожалуйста, выберите:', reply_markup=reply_markup)
+    update.effective_message.reply_text('Пожалуйста, выберите:', reply_markup=reply_markup)
     
     return 'HANDLE_MENU'
 
@@ -145,12 +175,12 @@ def start(update, context):
 def handle_menu(update, context):
     users_reply = update.callback_query.data
 
-    env = get_env()
+    moltin = context.bot_data['moltin']
 
     if users_reply == "cart":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
         
-        text, cart_keyboard = get_cart(update.effective_chat.id)
+        text, cart_keyboard = get_cart(context.bot_data['carts'], update.effective_chat.id)
 
         update.callback_query.message.reply_text(
             text=text,
@@ -159,18 +189,10 @@ def handle_menu(update, context):
 
         return 'HANDLE_CART'
 
-    product_data = get_product_by_id(
-        users_reply,
-        env['client_id'],
-        env['client_secret']
-    )
+    product_data = moltin.get_product_by_id(users_reply)
 
     product_sku = product_data['data']['sku']
-    image_url = get_image_url(
-        product_data['data']['relationships']['main_image']['data']['id'],
-        env['client_id'],
-        env['client_secret']
-    )
+    image_id = product_data['data']['relationships']['main_image']['data']['id']
 
     product_price = product_data['data']['price'][0]['amount']
 
@@ -194,8 +216,11 @@ def handle_menu(update, context):
         ]
     ]
 
-    update.callback_query.message.reply_photo(
-        image_url,
+    reply_product_photo(
+        update.callback_query.message,
+        context,
+        product_data['data']['id'],
+        image_id,
         caption=text,
         reply_markup=InlineKeyboardMarkup(options_keyboard)
     )
@@ -209,12 +234,12 @@ def handle_description(update, context):
 
     users_reply = update.callback_query.data
 
-    env = get_env()
+    moltin = context.bot_data['moltin']
 
     if users_reply == "cart":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
         
-        text, cart_keyboard = get_cart(update.effective_chat.id)
+        text, cart_keyboard = get_cart(context.bot_data['carts'], update.effective_chat.id)
 
         update.callback_query.message.reply_text(
             text=text,
@@ -225,7 +250,7 @@ def handle_description(update, context):
 
     if users_reply == "return":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
-        keyboard = get_menu_keyboard()
+        keyboard = get_menu_keyboard(moltin)
 
         reply_markup = InlineKeyboardMarkup(keyboard)
         update.callback_query.message.reply_text(
@@ -236,12 +261,10 @@ def handle_description(update, context):
         return 'HANDLE_MENU'
 
     product_id, quantity = users_reply.split(":")
-    add_product_to_cart(
+    context.bot_data['carts'].add(
         update.effective_chat.id,
         product_id,
-        int(quantity),
-        env['client_id'],
-        env['client_secret']
+        int(quantity)
     )
     update.callback_query.answer(text="Товар добавлен в корзину")
 
@@ -254,12 +277,12 @@ def handle_cart(update, context):
 
     users_reply = update.callback_query.data
 
-    env = get_env()
+    moltin = context.bot_data['moltin']
 
     if users_reply == "return":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
 
-        product_keyboard = get_menu_keyboard()
+        product_keyboard = get_menu_keyboard(moltin)
 
         update.callback_query.message.reply_text(
             text="Что Вам интересно?",
@@ -277,14 +300,9 @@ def handle_cart(update, context):
 
         return 'WAITING_GEO'
 
-    remove_product_from_cart(
-        update.effective_chat.id,
-        users_reply,
-        env['client_id'],
-        env['client_secret']
-    )
+    cart = context.bot_data['carts'].remove(update.effective_chat.id, users_reply)
 
-    text, cart_keyboard = get_cart(update.effective_chat.id)
+    text, cart_keyboard = render_cart(cart.items, cart.full_price)
 
     update.callback_query.answer(text='Товар удалён из корзины')
     update.callback_query.edit_message_text(
@@ -301,11 +319,11 @@ def waiting_geo(update, context):
     else:
         users_reply = update.message.text
 
-    env = get_env()
+    moltin = context.bot_data['moltin']
 
     if users_reply == "return":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
-        keyboard = get_menu_keyboard()
+        keyboard = get_menu_keyboard(moltin)
 
         reply_markup = InlineKeyboardMarkup(keyboard)
         update.callback_query.message.reply_text(
@@ -315,62 +333,46 @@ def waiting_geo(update, context):
 
         return 'HANDLE_MENU'
 
-    wrong_address = False
-
     if not users_reply:
         coords = (update.message.location.latitude, update.message.location.longitude)
     else:
-        coords = fetch_coordinates(env['apikey'], users_reply)
+        coords = context.bot_data['geocoder'].fetch_coordinates(users_reply)
 
     if not coords:
-        text = 'Такого адреса не существует. Введите адрес заново, либо вернитесь в меню.'
-        wrong_address = True
-    else:
-        all_pizzerias = get_all_pizzerias(env['client_id'], env['client_secret'])
-        
-        for pizzeria in all_pizzerias:
-            pizzeria['distance'] = distance.distance(
-                coords,
-                (pizzeria['latitude'], pizzeria['longitude'])
-            ).km
-    
-        nearest_pizzeria = min(
-            all_pizzerias,
-            key=lambda pizzeria: pizzeria['distance']
-        )
-        
-        text = get_text_of_delivery(
-            nearest_pizzeria['distance'],
-            nearest_pizzeria['address']
+        update.message.reply_text(
+            text='Такого адреса не существует. Введите адрес заново, либо вернитесь в меню.',
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("В меню", callback_data="return")]]
+            )
         )
 
-    options_keyboard = get_delivery_options_keyboard(nearest_pizzeria['distance'])
+        return 'WAITING_GEO'
+
+    [(min_distance, nearest_pizzeria)] = context.bot_data['pizzerias'].nearest(coords)
+
+    text = get_text_of_delivery(min_distance, nearest_pizzeria['address'])
+    options_keyboard = get_delivery_options_keyboard(min_distance)
 
     update.message.reply_text(
         text=text,
         reply_markup=InlineKeyboardMarkup(options_keyboard)
     )
 
-
     context.user_data['latitude'], context.user_data['longitude'] = coords
+    context.user_data['pizzeria_id'] = nearest_pizzeria['id']
     context.user_data['pizzeria_address'] = nearest_pizzeria['address']
 
-    if wrong_address:
-        state = 'WAITING_GEO'
-    else:
-        state = 'HANDLE_DELIVERY'
-    
-    return state
+    return 'HANDLE_DELIVERY'
 
 
 def handle_delivery(update, context):
     users_reply = update.callback_query.data
 
-    env = get_env()
+    moltin = context.bot_data['moltin']
 
     if users_reply == "return":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
-        keyboard = get_menu_keyboard()
+        keyboard = get_menu_keyboard(moltin)
 
         reply_markup = InlineKeyboardMarkup(keyboard)
         update.callback_query.message.reply_text(
@@ -383,21 +385,35 @@ def handle_delivery(update, context):
     if users_reply == 'delivery':
         chat_id = update.callback_query.message.chat.id
 
-        create_customers_address(
-            env['client_id'], 
-            env['client_secret'],
+        deliveryman_id = context.bot_data['pizzerias'].get_deliveryman_id(
+            pizzeria_id=context.user_data['pizzeria_id']
+        )
+
+        if deliveryman_id is None:
+            logger.warning(
+                'Не найден доставщик пиццерии %s',
+                context.user_data['pizzeria_id']
+            )
+            update.callback_query.edit_message_reply_markup(reply_markup=None)
+            options_keyboard = [
+                [InlineKeyboardButton("Самовывоз", callback_data="pickup")],
+                [InlineKeyboardButton("В меню", callback_data="return")]
+            ]
+            update.callback_query.message.reply_text(
+                'Сейчас не получается передать заказ в доставку. '
+                'Вы можете забрать его самостоятельно.',
+                reply_markup=InlineKeyboardMarkup(options_keyboard)
+            )
+
+            return 'HANDLE_DELIVERY'
+
+        moltin.create_customers_address(
             chat_id,
             context.user_data['latitude'],
             context.user_data['longitude']
         )
 
-        deliveryman_id = get_deliveryman_id_by_pizzeria_address(
-            env['client_id'], 
-            env['client_secret'],
-            context.user_data['pizzeria_address']
-        )
-
-        text, cart_keyboard = get_cart(chat_id)
+        text, cart_keyboard = get_cart(context.bot_data['carts'], chat_id)
 
         context.bot.send_message(
             chat_id = deliveryman_id,
@@ -415,7 +431,7 @@ def handle_delivery(update, context):
     if users_reply == 'pickup':
         text = dedent(
             f"""\
-            Отлично. Ваш заказ будет ждать вас по адресу: {pizzeria_address}.\
+            Отлично. Ваш заказ будет ждать вас по адресу: {context.user_data['pizzeria_address']}.\
             """
         )
 
@@ -437,11 +453,12 @@ def handle_delivery(update, context):
 def handle_payment(update, context):
     users_reply = update.callback_query.data
 
-    env = get_env()
+    settings = context.bot_data['settings']
+    moltin = context.bot_data['moltin']
 
     if users_reply == "return":
         update.callback_query.edit_message_reply_markup(reply_markup=None)
-        keyboard = get_menu_keyboard()
+        keyboard = get_menu_keyboard(moltin)
 
         reply_markup = InlineKeyboardMarkup(keyboard)
         update.callback_query.message.reply_text(
@@ -455,14 +472,10 @@ def handle_payment(update, context):
     title = "Оплата заказа"
     description = "Оплата заказа пиццы"
     payload = "Custom-Payload"
-    provider_token = env['payment_token']
+    provider_token = settings.payment_token
     currency = "rub"
 
-    cart_items, full_price = get_cart_and_full_price(
-        chat_id,
-        env['client_id'],
-        env['client_secret']
-    )
+    full_price = context.bot_data['carts'].refresh(chat_id).full_price
 
     full_price = full_price.replace(',', '')
     price = int(full_price)
@@ -515,26 +528,23 @@ def write_to_user(context):
 
 
 def handle_users_reply(update, context):
-    env = get_env()
-    db = get_database_connection(
-        env['database_password'],
-        env['database_host'],
-        env['database_port']
-    )
+    states = context.bot_data['states']
     if update.message:
         user_reply = update.message.text
         chat_id = update.message.chat_id
-        db_key = f"telegramid_{chat_id}"
     elif update.callback_query:
         user_reply = update.callback_query.data
         chat_id = update.callback_query.message.chat_id
-        db_key = f"telegramid_{chat_id}"
     else:
         return
-    if user_reply == '/start':
-        user_state = 'START'
+
+    user_state = states.load(chat_id)
+    context.user_data.update(user_state.data)
+
+    if user_reply == '/start' or not user_state.state:
+        current_state = 'START'
     else:
-        user_state = db.get(db_key).decode("utf-8")
+        current_state = user_state.state
 
     states_functions = {
         'START': start,
@@ -545,40 +555,179 @@ def handle_users_reply(update, context):
         'HANDLE_DELIVERY': handle_delivery,
         'HANDLE_PAYMENT': handle_payment
     }
-    state_handler = states_functions[user_state]
+    state_handler = states_functions[current_state]
 
     try:
-        next_state = state_handler(update, context)
-        db.set(db_key, next_state)
+        with memo_scope(f'telegram {chat_id}'), observe_handler('telegram', current_state):
+            next_state = state_handler(update, context)
+        states.save(
+            chat_id,
+            next_state,
+            dict(context.user_data),
+            version=user_state.version
+        )
+    except StaleStateError as err:
+        logger.warning(err)
     except Exception as err:
-        print(err)
+        logger.exception('Не удалось обработать сообщение чата %s', chat_id)
+
+        if is_unavailable(err):
+            try:
+                context.bot.send_message(
+                    chat_id,
+                    'Сервис временно недоступен, попробуйте чуть позже.'
+                )
+            except Exception:
+                logger.exception('Не удалось предупредить чат %s', chat_id)
+
+
+def get_chat_id(update):
+    if update.message:
+        return update.message.chat_id
+    elif update.callback_query:
+        return update.callback_query.message.chat_id
+
+
+def dispatch_users_reply(update, context):
+    executor = context.bot_data.get('executor')
+    if not executor:
+        handle_users_reply(update, context)
+        return
+
+    chat_id = get_chat_id(update)
+    if chat_id is None:
+        return
+
+    executor.submit(chat_id, handle_users_reply, update, context)
+
+
+def log_dispatch_stats(context):
+    logger.info('Очереди обработчиков: %s', context.bot_data['executor'].stats())
 
 
 def get_database_connection(password, host, port):
     global _database
     if not _database:
-        _database = redis.Redis(host=host, port=port, password=password)
+        _database = InstrumentedRedis(host=host, port=port, password=password)
     return _database
 
 
-def get_env():
-    env = Env()
-    env.read_env()
+def handle_error(update, context):
+    logger.warning('Update "%s" caused error "%s"', update, context.error)
 
-    return {
-        'tg_token': env("TELEGRAM_TOKEN"),
-        'client_id': env('CLIENT_ID'),
-        'client_secret': env('CLIENT_SECRET'),
-        'database_password': env("REDIS_PASSWORD"),
-        'database_host': env("REDIS_HOST"),
-        'database_port': env("REDIS_PORT"),
-        'apikey': env('YANDEX_API'),
-        'payment_token': env('PAYMENT_PROVIDER_TOKEN')
-    }
 
+def create_updater(settings):
+    db = get_database_connection(
+        settings.database_password,
+        settings.database_host,
+        settings.database_port
+    )
+    updater = Updater(settings.tg_token, base_url=settings.tg_api_url)
+    dispatcher = updater.dispatcher
+    dispatcher.bot_data['moltin'] = MoltinClient(
+        settings.client_id,
+        settings.client_secret,
+        base_url=settings.moltin_api_url,
+        pool_size=settings.moltin_pool_size,
+        timeout=settings.moltin_timeout,
+        catalog_ttl=settings.catalog_ttl,
+        failure_threshold=settings.circuit_failure_threshold,
+        reset_timeout=settings.circuit_reset_timeout,
+        redis=db
+    )
+    dispatcher.bot_data['geocoder'] = GeocoderCache(
+        settings.apikey,
+        redis=db,
+        positive_ttl=settings.geocode_ttl,
+        negative_ttl=settings.geocode_negative_ttl,
+        base_url=settings.yandex_geocoder_url
+    )
+    dispatcher.bot_data['pizzerias'] = PizzeriaSnapshot(
+        dispatcher.bot_data['moltin'].iter_pizzerias,
+        refresh_interval=settings.pizzerias_refresh_interval
+    )
+    dispatcher.bot_data['carts'] = CartService(
+        dispatcher.bot_data['moltin'],
+        ttl=settings.cart_ttl
+    )
+    dispatcher.bot_data['photos'] = PhotoCache(db)
+    dispatcher.bot_data['states'] = StateStore(
+        db,
+        'telegram_state_',
+        ttl=settings.state_ttl
+    )
+    dispatcher.bot_data['settings'] = settings
+
+    register_cache('moltin_catalog', dispatcher.bot_data['moltin'].catalog_cache.stats)
+    register_cache('moltin_images', dispatcher.bot_data['moltin'].image_cache.stats)
+    register_cache('telegram_carts', dispatcher.bot_data['carts'].carts.stats)
+    register_cache('geocoder', dispatcher.bot_data['geocoder'].stats)
 
-def handle_error(bot, update, error):
-    logger.warning('Update "%s" caused error "%s"', update, error)
+    reload_on_sighup(
+        lambda settings: dispatcher.bot_data.update(settings=settings)
+    )
+
+    if settings.dispatch_mode == 'keyed':
+        dispatcher.bot_data['executor'] = KeyedExecutor(
+            workers=settings.dispatch_workers,
+            max_queue_size=settings.dispatch_queue_size,
+            name='chat-worker'
+        )
+
+        if settings.dispatch_stats_interval:
+            updater.job_queue.run_repeating(
+                log_dispatch_stats,
+                settings.dispatch_stats_interval
+            )
+
+    dispatcher.add_handler(CallbackQueryHandler(dispatch_users_reply))
+    dispatcher.add_handler(MessageHandler(Filters.text, dispatch_users_reply))
+    dispatcher.add_handler(MessageHandler(Filters.location, dispatch_users_reply))
+    dispatcher.add_handler(CommandHandler('start', dispatch_users_reply))
+    dispatcher.add_error_handler(handle_error)
+
+    return updater
+
+
+def run_webhook_worker(updater, settings):
+    dispatcher = updater.dispatcher
+    db = get_database_connection(
+        settings.database_password,
+        settings.database_host,
+        settings.database_port
+    )
+    updates = ShardedQueue(db, 'tg_updates', shards=settings.tg_update_shards)
+
+    if settings.tg_webhook_url and settings.tg_worker_index == 0:
+        updater.bot.set_webhook(
+            settings.tg_webhook_url,
+            api_kwargs={'secret_token': settings.tg_webhook_secret}
+        )
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    shards = [
+        shard for shard in range(updates.shards)
+        if shard % settings.tg_worker_count == settings.tg_worker_index
+    ]
+    logger.info('Обрабатываю шарды обновлений %s', shards)
+
+    updater.job_queue.start()
+    threads = consume(
+        updates,
+        shards,
+        lambda payload: dispatcher.process_update(
+            Update.de_json(payload, updater.bot)
+        ),
+        stop_event=stop_event
+    )
+
+    stop_event.wait()
+    for thread in threads:
+        thread.join()
+    updater.job_queue.stop()
 
 
 def main():
@@ -587,17 +736,21 @@ def main():
         level=logging.INFO
     )
 
-    env = get_env()
-    updater = Updater(env['tg_token'])
-    dispatcher = updater.dispatcher
-    dispatcher.add_handler(CallbackQueryHandler(handle_users_reply))
-    dispatcher.add_handler(MessageHandler(Filters.text, handle_users_reply))
-    dispatcher.add_handler(MessageHandler(Filters.location, handle_users_reply))
-    dispatcher.add_handler(CommandHandler('start', handle_users_reply))
-    dispatcher.add_error_handler(handle_error)
-    updater.start_polling()
-    updater.idle()
+    settings = get_settings()
+    updater = create_updater(settings)
+
+    if settings.metrics_port:
+        start_http_server(settings.metrics_port)
+
+    if settings.tg_mode == 'webhook':
+        run_webhook_worker(updater, settings)
+    else:
+        updater.start_polling()
+        updater.idle()
+
+    if updater.dispatcher.bot_data.get('executor'):
+        updater.dispatcher.bot_data['executor'].shutdown()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,83 @@
+import logging
+from collections import namedtuple
+
+from requests import HTTPError
+
+from caching import TTLCache
+from moltin_api import parse_cart
+
+logger = logging.getLogger(__name__)
+
+Cart = namedtuple('Cart', ['items', 'full_price'])
+
+
+class CartService:
+    """Локальная копия корзин Moltin, которая обновляется ответами на изменения.
+
+    Добавление и удаление товара возвращают всю корзину, поэтому после них
+    корзину не нужно перечитывать. Moltin запрашивается, только если копии
+    нет или изменение не удалось: при таймауте запрос мог дойти до Moltin,
+    поэтому копия сбрасывается при любой ошибке. Обновления одного чата обрабатывает один
+    процесс, поэтому копия в памяти не расходится с другими процессами.
+    """
+
+    def __init__(self, moltin, ttl=600, maxsize=1024):
+        self.moltin = moltin
+        self.carts = TTLCache(ttl, maxsize=maxsize)
+
+    def get(self, cart_id):
+        cart = self.carts.get(cart_id)
+
+        return cart or self.refresh(cart_id)
+
+    def refresh(self, cart_id):
+        items, full_price = self.moltin.get_cart_and_full_price(cart_id)
+
+        return self._store(cart_id, items, full_price)
+
+    def add(self, cart_id, product_id, quantity):
+        try:
+            items_info = self.moltin.add_product_to_cart(
+                cart_id,
+                product_id,
+                quantity
+            )
+        except Exception:
+            self.carts.invalidate(cart_id)
+            raise
+
+        return self._store_response(cart_id, items_info)
+
+    def remove(self, cart_id, item_id):
+        try:
+            items_info = self.moltin.remove_product_from_cart(cart_id, item_id)
+        except HTTPError as err:
+            if err.response is None or err.response.status_code != 404:
+                self.carts.invalidate(cart_id)
+                raise
+
+            logger.info('Товара %s уже нет в корзине %s', item_id, cart_id)
+            return self.refresh(cart_id)
+        except Exception:
+            self.carts.invalidate(cart_id)
+            raise
+
+        return self._store_response(cart_id, items_info)
+
+    def invalidate(self, cart_id):
+        self.carts.invalidate(cart_id)
+
+    def _store_response(self, cart_id, items_info):
+        try:
+            items, full_price = parse_cart(items_info)
+        except (KeyError, TypeError):
+            logger.warning('Неожиданный ответ Moltin для корзины %s', cart_id)
+            return self.refresh(cart_id)
+
+        return self._store(cart_id, items, full_price)
+
+    def _store(self, cart_id, items, full_price):
+        cart = Cart(items, full_price)
+        self.carts.set(cart_id, cart)
+
+        return cart
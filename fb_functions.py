@@ -1,97 +1,244 @@
 from time import time
+from urllib.parse import urlencode
 import json
-import os
+import logging
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import observe_http
+from moltin_api import get_last_category_id
+from resilience import CallPolicy, CircuitBreaker
+
+GRAPH_API_URL = "https://graph.facebook.com"
+GRAPH_API_VERSION = "v2.6"
+MAX_BATCH_SIZE = 50
+# При этих статусах Graph API просит повторить запрос позже.
+GRAPH_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+
+def get_retry_after(response, max_wait=30):
+    """Пауза, которую Graph API попросил в Retry-After или X-Business-Use-Case-Usage."""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), max_wait)
+
+    usage = response.headers.get('X-Business-Use-Case-Usage')
+    if usage:
+        try:
+            minutes = max(
+                limit.get('estimated_time_to_regain_access', 0)
+                for limits in json.loads(usage).values()
+                for limit in limits
+            )
+        except (ValueError, AttributeError):
+            minutes = 0
+
+        if minutes:
+            return min(minutes * 60, max_wait)
+
+    return None
+
+
+class FBSender:
+    """Отправляет сообщения в Graph API через общий пул соединений.
+
+    Ответы 429 и 5xx повторяются с паузой из заголовков Retry-After или
+    X-Business-Use-Case-Usage, а если их нет — с экспоненциальной паузой
+    и jitter. Ошибки соединения повторяются, только если запрос точно не
+    дошёл до Graph API, чтобы сообщение не пришло дважды.
+    """
+
+    def __init__(
+        self,
+        access_token,
+        base_url=GRAPH_API_URL,
+        version=GRAPH_API_VERSION,
+        pool_size=10,
+        timeout=(3.05, 10),
+        max_retries=3,
+        backoff=0.5,
+        max_wait=30
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.version = version
+        self.breaker = CircuitBreaker('graph')
+        self.policy = CallPolicy(
+            self.breaker,
+            timeout=timeout,
+            retries=max_retries,
+            backoff=backoff,
+            max_backoff=max_wait,
+            non_idempotent_retry_statuses=GRAPH_RETRY_STATUSES,
+            get_retry_after=lambda response: get_retry_after(response, max_wait)
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.params = {"access_token": access_token}
+
+    def _post(self, url, endpoint='messages', **kwargs):
+        response = self.policy.call(
+            lambda timeout: observe_http(
+                'graph',
+                endpoint,
+                lambda: self.session.post(url, timeout=timeout, **kwargs)
+            ),
+            idempotent=False
+        )
+        response.raise_for_status()
+
+        return response.json()
+
+    def send(self, recipient_id, message):
+        request_content = {
+            "recipient": {
+                "id": recipient_id
+            },
+            "message": message
+        }
 
-from database_functions import get_database_connection
-from moltin_api import get_image_url, get_products_by_category_id
-from moltin_api import get_all_categories, get_last_category
-from moltin_api import get_cart_and_full_price
+        return self._post(
+            f"{self.base_url}/{self.version}/me/messages",
+            json=request_content
+        )
+
+    def send_batch(self, messages):
+        results = []
+
+        for start in range(0, len(messages), MAX_BATCH_SIZE):
+            operations = []
+            last_operation = {}
+
+            for number, (recipient_id, message) in enumerate(
+                messages[start:start + MAX_BATCH_SIZE]
+            ):
+                operation = {
+                    "method": "POST",
+                    "name": f"message{number}",
+                    "relative_url": f"{self.version}/me/messages",
+                    "body": urlencode({
+                        "recipient": json.dumps({"id": recipient_id}),
+                        "message": json.dumps(message),
+                    }),
+                }
+                if recipient_id in last_operation:
+                    operation["depends_on"] = last_operation[recipient_id]
+                last_operation[recipient_id] = operation["name"]
 
-FACEBOOK_TOKEN = os.environ["PAGE_ACCESS_TOKEN"]
+                operations.append(operation)
 
+            batch_results = self._post(
+                self.base_url,
+                endpoint='batch',
+                data={"batch": json.dumps(operations)}
+            )
 
-def send_message(recipient_id, message_text):
-    params = {"access_token": FACEBOOK_TOKEN}
-    headers = {"Content-Type": "application/json"}
-    request_content = {
-        "recipient": {
-            "id": recipient_id
-        },
-        "message": {
-            "text": message_text
-        }
-    }
-    response = requests.post(
-        "https://graph.facebook.com/v2.6/me/messages",
-        params=params, headers=headers, json=request_content
-    )
-    response.raise_for_status()
+            for result in batch_results:
+                if result and result.get("code", 200) >= 400:
+                    raise requests.HTTPError(
+                        f"Graph batch operation failed: {result.get('body')}"
+                    )
 
+            results.extend(batch_results)
 
-def send_menu(recipient_id, message, app_config):
-    params = {"access_token": FACEBOOK_TOKEN}
-    headers = {"Content-Type": "application/json"}
+        return results
 
-    request_content = {
-        "recipient": {
-            "id": recipient_id
-        },
-        "message": {
-            "attachment": get_menu(message, app_config)
-        }
-    }
+    def batch(self):
+        return FBBatch(self)
 
-    response = requests.post(
-        "https://graph.facebook.com/v2.6/me/messages",
-        params=params, headers=headers, json=request_content
-    )
-    response.raise_for_status()
 
+class FBBatch:
+    """Копит сообщения и отправляет их одним batch-запросом при выходе из with.
 
-def send_cart_menu(recipient_id, message):
-    params = {"access_token": FACEBOOK_TOKEN}
-    headers = {"Content-Type": "application/json"}
+    Сообщения одному получателю связаны через depends_on, поэтому приходят
+    в том же порядке, в каком были добавлены.
+    """
 
-    request_content = {
-        "recipient": {
-            "id": recipient_id
-        },
-        "message": {
-            "attachment": {
-                "type": "template",
-                "payload": {
-                    "template_type": "generic",
-                    "elements": get_elements_for_cart(recipient_id, message)
-                }
-            }
+    def __init__(self, sender):
+        self.sender = sender
+        self.messages = []
+
+    def send(self, recipient_id, message):
+        self.messages.append((recipient_id, message))
+
+    def flush(self):
+        messages, self.messages = self.messages, []
+
+        if len(messages) == 1:
+            return [self.sender.send(*messages[0])]
+
+        return self.sender.send_batch(messages) if messages else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not exc_type:
+            self.flush()
+
+
+def send_message(recipient_id, message_text, sender):
+    sender.send(recipient_id, {"text": message_text})
+
+
+def send_menu(recipient_id, message, app_config, sender=None):
+    sender = sender or app_config['sender']
+    sender.send(recipient_id, {"attachment": get_menu(message, app_config)})
+
+
+def send_cart_menu(recipient_id, message, app_config, sender=None):
+    sender = sender or app_config['sender']
+
+    attachment = {
+        "type": "template",
+        "payload": {
+            "template_type": "generic",
+            "elements": get_elements_for_cart(
+                recipient_id,
+                message,
+                app_config['carts']
+            )
         }
     }
 
-    response = requests.post(
-        "https://graph.facebook.com/v2.6/me/messages",
-        params=params, headers=headers, json=request_content
-    )
-    response.raise_for_status()
+    sender.send(recipient_id, {"attachment": attachment})
 
 
-def create_menu(message):
-    elements = []
-    buttons = []
+def get_requested_category_id(message):
+    if message['type'] == 'postback' and message['value'] != 'return':
+        return message['value']
 
-    client_id = os.environ["CLIENT_ID"]
-    client_secret = os.environ["CLIENT_SECRET"]
 
-    categories = get_all_categories(client_id, client_secret)
+def create_menu(message, moltin):
+    category_id = get_requested_category_id(message) or moltin.get_last_category()
 
-    if message['type'] == 'message':
-        category_id = get_last_category(client_id, client_secret)
-    elif message['type'] == 'postback':
-        if message['value'] == 'return':
-            category_id = get_last_category(client_id, client_secret)
-        else:
-            category_id = message['value']
+    return create_category_menu(category_id, moltin)
+
+
+def create_category_menu(category_id, moltin):
+    categories = moltin.get_all_categories()
+
+    products = {'data': []}
+    image_urls = {}
+
+    if any(category['id'] == category_id for category in categories['data']):
+        products = moltin.get_products_by_category_id(category_id)
+        image_urls = moltin.get_image_urls(
+            product["relationships"]["main_image"]["data"]["id"]
+            for product in products["data"]
+        )
+
+    return build_menu(categories, category_id, products, image_urls)
+
+
+def build_menu(categories, category_id, products, image_urls):
+    elements = []
+    buttons = []
 
     image_url = "https://img.freepik.com/premium-vector/pizza-logo-template-suitable-for-restaurant-and-cafe-logo_607277-267.jpg"
 
@@ -122,14 +269,13 @@ def create_menu(message):
 
     for category in categories['data']:
         if category_id == category['id']:
-            products = get_products_by_category_id(client_id, client_secret, category_id)
             for product in products["data"]:
                 product_name = product["name"]
                 price = product["price"][0]["amount"]
                 title = f"{product_name} ({price} р.)"
 
                 image_id = product["relationships"]["main_image"]["data"]["id"]
-                image_url = get_image_url(image_id, client_id, client_secret)
+                image_url = image_urls[image_id]
 
                 element = {
                     "title": title,
@@ -177,14 +323,15 @@ def create_menu(message):
     return menu
 
 
-def get_elements_for_cart(sender_id, message):
-    elements = []
+def get_elements_for_cart(sender_id, message, carts):
+    cart_id = f"facebookid_{sender_id}"
+    cart = carts.get(cart_id)
 
-    client_id = os.environ["CLIENT_ID"]
-    client_secret = os.environ["CLIENT_SECRET"]
+    return build_cart_elements(cart.items, cart.full_price)
 
-    cart_id = f"facebookid_{sender_id}"
-    cart_items, full_price = get_cart_and_full_price(cart_id, client_id, client_secret)
+
+def build_cart_elements(cart_items, full_price):
+    elements = []
 
     image_url = "https://img.freepik.com/premium-vector/wicker-basket-on-white-background_43633-1813.jpg?w=740"
 
@@ -237,35 +384,18 @@ def get_elements_for_cart(sender_id, message):
     return elements
 
 
+def get_menu_category_id(message, categories):
+    category_id = get_requested_category_id(message)
+    category_ids = [category['id'] for category in categories['data']]
+
+    if category_id in category_ids:
+        return category_id
+
+    return get_last_category_id(categories)
+
+
 def get_menu(message, app_config):
-    db = app_config['database']
-
-    if message['type'] == 'message' or message['value'] == 'return':
-        menu_type = 'main'
-    elif message['title'] == 'Основные пиццы':
-        menu_type = 'main'
-    elif message['title'] == 'Особые пиццы':
-        menu_type = 'special'
-    elif message['title'] == 'Сытные пиццы':
-        menu_type = 'nourishing'
-    elif message['title'] == 'Острые пиццы':
-        menu_type = 'hot'
-
-    cached_menu = db.get(menu_type)
-    
-    if cached_menu:
-        cached_menu = json.loads(cached_menu)
-        time_diff = time() - cached_menu['created_at']
-        if time_diff > 3600:
-            menu = create_menu(message)
-            db.set(menu_type, json.dumps(menu))
-            menu = menu['attachment']
-        else:
-            menu = cached_menu['attachment']
-    else:
-        menu = create_menu(message)
-        db.set(menu_type, json.dumps(menu))
-        menu = menu['attachment']
+    categories = app_config['moltin'].get_all_categories()
+    category_id = get_menu_category_id(message, categories)
 
-    return menu
-        
\ No newline at end of file
+    return app_config['menus'].get(category_id)['attachment']
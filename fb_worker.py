@@ -0,0 +1,61 @@
+import logging
+import signal
+import threading
+
+from prometheus_client import start_http_server
+
+from app import get_app_config, handle_event
+from settings import reload_on_sighup
+from update_queue import consume
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_menus(app_config):
+    menus = app_config['menus']
+
+    try:
+        categories = app_config['moltin'].get_all_categories()
+    except Exception as err:
+        logger.warning('Не удалось получить категории для меню: %s', err)
+        return
+
+    menus.refresh(category['id'] for category in categories['data'])
+    logger.info('Кэш меню: %s', menus.stats())
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    app_config = get_app_config({})
+    events = app_config['events']
+
+    if app_config['settings'].metrics_port:
+        start_http_server(app_config['settings'].metrics_port)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    reload_on_sighup(lambda settings: app_config.update(settings=settings))
+
+    threads = consume(
+        events,
+        range(events.shards),
+        lambda event: handle_event(event, app_config),
+        stop_event=stop_event,
+        timeout=app_config['settings'].fb_event_poll_timeout
+    )
+
+    refresh_menus(app_config)
+    while not stop_event.wait(app_config['settings'].menu_ttl):
+        refresh_menus(app_config)
+
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
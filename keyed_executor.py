@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedExecutor:
+    """Пул потоков, где задачи с одним ключом выполняет один и тот же поток.
+
+    Ключ хэшируется в номер потока, поэтому задачи одного чата идут строго
+    по очереди, а задачи разных чатов — параллельно. При max_queue_size > 0
+    submit ждёт, пока в очереди потока освободится место.
+    """
+
+    def __init__(self, workers=8, max_queue_size=0, name='keyed-worker'):
+        self.max_queue_size = max_queue_size
+        self.processed = 0
+        self.failed = 0
+
+        self._queues = [queue.Queue(maxsize=max_queue_size) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(task_queue,),
+                name=f'{name}-{number}',
+                daemon=True
+            )
+            for number, task_queue in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def workers(self):
+        return len(self._queues)
+
+    def get_worker_number(self, key):
+        return zlib.crc32(str(key).encode()) % self.workers
+
+    def submit(self, key, function, *args, **kwargs):
+        self._queues[self.get_worker_number(key)].put((function, args, kwargs))
+
+    def queue_depths(self):
+        return [task_queue.qsize() for task_queue in self._queues]
+
+    def stats(self):
+        depths = self.queue_depths()
+
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': sum(depths),
+                'max_depth': max(depths),
+                'max_queue_size': self.max_queue_size,
+                'processed': self.processed,
+                'failed': self.failed,
+            }
+
+    def shutdown(self, wait=True):
+        for task_queue in self._queues:
+            task_queue.put(None)
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _work(self, task_queue):
+        while True:
+            task = task_queue.get()
+            if task is None:
+                return
+
+            function, args, kwargs = task
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                logger.exception('Ошибка в задаче %s', function.__name__)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.processed += 1
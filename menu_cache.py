@@ -0,0 +1,219 @@
+import json
+import logging
+import threading
+import time
+
+from redis.exceptions import LockError, RedisError
+
+from metrics import MENU_FAILED_REBUILDS, MENU_REBUILDS, observe_menu
+
+logger = logging.getLogger(__name__)
+
+
+class MenuCache:
+    """Кэш готовых меню Facebook в Redis по id категории.
+
+    Устаревшее меню отдаётся сразу, а пересобирает его фоновый поток. Чтобы
+    меню одной категории не собирали одновременно несколько процессов,
+    сборка идёт под блокировкой в Redis. Ждать сборки приходится, только
+    когда меню категории в кэше ещё нет.
+    """
+
+    def __init__(
+        self,
+        redis,
+        build_menu,
+        ttl=3600,
+        stale_ttl=24 * 3600,
+        lock_timeout=60,
+        key_prefix='facebook_menu:'
+    ):
+        self.redis = redis
+        self.build_menu = build_menu
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.key_prefix = key_prefix
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.failed_rebuilds = 0
+
+        self._menus = {}
+        self._rebuilding = set()
+        self._lock = threading.Lock()
+
+    def get_key(self, category_id):
+        return f'{self.key_prefix}{category_id}'
+
+    def get(self, category_id):
+        entry = self._read(category_id)
+
+        if not entry:
+            self._count('misses')
+            return self._rebuild_now(category_id)
+
+        if time.time() - entry['created_at'] < self.ttl:
+            self._count('hits')
+        else:
+            self._count('stale_hits')
+            self._rebuild_in_background(category_id)
+
+        return entry['menu']
+
+    def refresh(self, category_ids):
+        for category_id in category_ids:
+            self._rebuild_in_background(category_id)
+
+    def stats(self):
+        now = time.time()
+
+        with self._lock:
+            requests_count = self.hits + self.stale_hits + self.misses
+
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.stale_hits) / requests_count if requests_count else 0,
+                'rebuilds': self.rebuilds,
+                'failed_rebuilds': self.failed_rebuilds,
+                'menus': {
+                    category_id: {
+                        'age_seconds': now - entry['created_at'],
+                        'rebuild_seconds': entry['rebuild_seconds'],
+                    }
+                    for category_id, entry in self._menus.items()
+                },
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _remember(self, category_id, entry):
+        with self._lock:
+            self._menus[category_id] = {
+                'created_at': entry['created_at'],
+                'rebuild_seconds': entry['rebuild_seconds'],
+            }
+
+        observe_menu(category_id, entry['created_at'], entry['rebuild_seconds'])
+
+    def _read(self, category_id):
+        try:
+            raw_entry = self.redis.get(self.get_key(category_id))
+        except RedisError as err:
+            logger.warning('Не удалось прочитать меню из Redis: %s', err)
+            return None
+
+        if not raw_entry:
+            return None
+
+        entry = json.loads(raw_entry)
+        self._remember(category_id, entry)
+
+        return entry
+
+    def _build(self, category_id):
+        started_at = time.perf_counter()
+        try:
+            menu = self.build_menu(category_id)
+        except Exception:
+            self._count('failed_rebuilds')
+            MENU_FAILED_REBUILDS.inc()
+            raise
+
+        entry = {
+            'menu': menu,
+            'created_at': time.time(),
+            'rebuild_seconds': time.perf_counter() - started_at,
+        }
+
+        try:
+            self.redis.set(
+                self.get_key(category_id),
+                json.dumps(entry),
+                ex=self.ttl + self.stale_ttl
+            )
+        except RedisError as err:
+            logger.warning('Не удалось сохранить меню в Redis: %s', err)
+
+        self._remember(category_id, entry)
+        self._count('rebuilds')
+        MENU_REBUILDS.inc()
+        logger.info(
+            'Меню категории %s собрано за %.2f с',
+            category_id,
+            entry['rebuild_seconds']
+        )
+
+        return entry
+
+    def _get_lock(self, category_id):
+        return self.redis.lock(
+            f'{self.get_key(category_id)}:lock',
+            timeout=self.lock_timeout,
+            thread_local=False
+        )
+
+    def _rebuild_now(self, category_id):
+        lock = self._get_lock(category_id)
+
+        try:
+            acquired = lock.acquire(blocking_timeout=self.lock_timeout)
+        except RedisError as err:
+            logger.warning('Не удалось взять блокировку меню: %s', err)
+            return self._build(category_id)['menu']
+
+        try:
+            entry = self._read(category_id) if acquired else None
+
+            return entry['menu'] if entry else self._build(category_id)['menu']
+        finally:
+            if acquired:
+                self._release(lock)
+
+    def _rebuild_in_background(self, category_id):
+        with self._lock:
+            if category_id in self._rebuilding:
+                return
+            self._rebuilding.add(category_id)
+
+        lock = self._get_lock(category_id)
+
+        try:
+            acquired = lock.acquire(blocking=False)
+        except RedisError as err:
+            logger.warning('Не удалось взять блокировку меню: %s', err)
+            acquired = False
+
+        if not acquired:
+            with self._lock:
+                self._rebuilding.discard(category_id)
+            return
+
+        threading.Thread(
+            target=self._rebuild,
+            args=(category_id, lock),
+            name=f'menu-rebuild-{category_id}',
+            daemon=True
+        ).start()
+
+    def _rebuild(self, category_id, lock):
+        try:
+            self._build(category_id)
+        except Exception:
+            logger.exception('Не удалось пересобрать меню категории %s', category_id)
+        finally:
+            self._release(lock)
+            with self._lock:
+                self._rebuilding.discard(category_id)
+
+    def _release(self, lock):
+        try:
+            lock.release()
+        except (LockError, RedisError) as err:
+            logger.warning('Не удалось снять блокировку меню: %s', err)
@@ -0,0 +1,185 @@
+import os
+import time
+from contextlib import contextmanager
+
+import redis
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from redis.client import Pipeline
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+EXTERNAL_CALL_SECONDS = Histogram(
+    'pizza_bot_external_call_seconds',
+    'Длительность запросов к внешним сервисам',
+    ['service', 'endpoint'],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_CALLS = Counter(
+    'pizza_bot_external_calls_total',
+    'Запросы к внешним сервисам по статусу ответа или типу ошибки',
+    ['service', 'endpoint', 'status'],
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    'pizza_bot_redis_command_seconds',
+    'Длительность команд Redis',
+    ['command'],
+    buckets=LATENCY_BUCKETS,
+)
+REDIS_COMMANDS = Counter(
+    'pizza_bot_redis_commands_total',
+    'Команды Redis по результату',
+    ['command', 'status'],
+)
+HANDLER_SECONDS = Histogram(
+    'pizza_bot_handler_seconds',
+    'Длительность обработчиков состояний',
+    ['frontend', 'state'],
+    buckets=LATENCY_BUCKETS,
+)
+HANDLER_CALLS = Counter(
+    'pizza_bot_handler_calls_total',
+    'Вызовы обработчиков состояний по результату',
+    ['frontend', 'state', 'status'],
+)
+CACHE_HIT_RATIO = Gauge(
+    'pizza_bot_cache_hit_ratio',
+    'Доля попаданий в кэш с запуска процесса',
+    ['cache'],
+    multiprocess_mode='max',
+)
+CACHE_REQUESTS = Gauge(
+    'pizza_bot_cache_requests',
+    'Обращения к кэшу с запуска процесса',
+    ['cache', 'result'],
+    multiprocess_mode='livesum',
+)
+MENU_AGE_SECONDS = Gauge(
+    'pizza_bot_menu_age_seconds',
+    'Возраст меню категории facebook в кэше',
+    ['category'],
+    multiprocess_mode='min',
+)
+MENU_REBUILD_SECONDS = Gauge(
+    'pizza_bot_menu_rebuild_seconds',
+    'Длительность последней сборки меню категории facebook',
+    ['category'],
+    multiprocess_mode='max',
+)
+MENU_REBUILDS = Counter(
+    'pizza_bot_menu_rebuilds_total',
+    'Собранные меню facebook',
+)
+MENU_FAILED_REBUILDS = Counter(
+    'pizza_bot_menu_failed_rebuilds_total',
+    'Сборки меню facebook, которые завершились ошибкой',
+)
+
+
+def observe_http(service, endpoint, send):
+    """Выполняет запрос send() и записывает его длительность и статус."""
+    started_at = time.perf_counter()
+    status = 'error'
+
+    try:
+        response = send()
+        status = str(response.status_code)
+        return response
+    except Exception as err:
+        status = type(err).__name__
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, endpoint).observe(
+            time.perf_counter() - started_at
+        )
+        EXTERNAL_CALLS.labels(service, endpoint, status).inc()
+
+
+@contextmanager
+def observe_handler(frontend, state):
+    started_at = time.perf_counter()
+    status = 'ok'
+
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        HANDLER_SECONDS.labels(frontend, state).observe(time.perf_counter() - started_at)
+        HANDLER_CALLS.labels(frontend, state, status).inc()
+
+
+def register_cache(name, get_stats):
+    """Показывает в метриках статистику кэша, get_stats() вызывается при сборе."""
+    CACHE_HIT_RATIO.labels(name).set_function(lambda: get_stats()['hit_ratio'])
+
+    for result in ('hits', 'misses'):
+        CACHE_REQUESTS.labels(name, result).set_function(
+            lambda result=result: get_stats()[result]
+        )
+
+
+def observe_menu(category_id, created_at, rebuild_seconds):
+    """Запоминает, когда и за сколько собрано меню категории."""
+    MENU_AGE_SECONDS.labels(category_id).set_function(lambda: time.time() - created_at)
+    MENU_REBUILD_SECONDS.labels(category_id).set(rebuild_seconds)
+
+
+def _observe_redis(command, execute):
+    started_at = time.perf_counter()
+    status = 'ok'
+
+    try:
+        return execute()
+    except Exception as err:
+        status = type(err).__name__
+        raise
+    finally:
+        REDIS_COMMAND_SECONDS.labels(command).observe(time.perf_counter() - started_at)
+        REDIS_COMMANDS.labels(command, status).inc()
+
+
+class InstrumentedPipeline(Pipeline):
+
+    def execute(self, raise_on_error=True):
+        return _observe_redis(
+            'PIPELINE',
+            lambda: super(InstrumentedPipeline, self).execute(raise_on_error)
+        )
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis, который записывает длительность и результат каждой команды."""
+
+    def execute_command(self, *args, **options):
+        return _observe_redis(
+            str(args[0]).upper(),
+            lambda: super(InstrumentedRedis, self).execute_command(*args, **options)
+        )
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint
+        )
+
+
+def render_metrics():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
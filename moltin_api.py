@@ -1,73 +1,404 @@
-import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from caching import TTLCache
+from metrics import observe_http
+from moltin_auth import TokenManager
+from request_memo import get_memo
+from resilience import CallPolicy, CircuitBreaker, is_unavailable
+
+API_URL = 'https://api.moltin.com'
+ENDPOINT_RETRIES = {
+    'auth': 1,
+    'catalog': 2,
+    'cart': 1,
+    'flows': 2,
+}
+
+logger = logging.getLogger(__name__)
+_missing = object()
+
+_clients = {}
+
+
+class MoltinClient:
+    """Клиент Moltin API с общим пулом keep-alive соединений."""
+
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        base_url=API_URL,
+        pool_size=10,
+        timeout=(3.05, 10),
+        keep_alive=True,
+        redis=None,
+        token_refresh_margin=60,
+        catalog_ttl=300,
+        catalog_maxsize=256,
+        image_ttl=24 * 3600,
+        image_maxsize=2048,
+        timeouts=None,
+        failure_threshold=5,
+        reset_timeout=30
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        self.breaker = CircuitBreaker(
+            'moltin',
+            failure_threshold=failure_threshold,
+            reset_timeout=reset_timeout
+        )
+        timeouts = timeouts or {}
+        self.policies = {
+            endpoint: CallPolicy(
+                self.breaker,
+                timeout=timeouts.get(endpoint, timeout),
+                retries=retries
+            )
+            for endpoint, retries in ENDPOINT_RETRIES.items()
+        }
 
-expires_on = 0
-access_token = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self.tokens = TokenManager(
+            self._fetch_access_token,
+            refresh_margin=token_refresh_margin,
+            redis=redis,
+            redis_key=f'moltin_access_token:{client_id}'
+        )
+        self.catalog_cache = TTLCache(catalog_ttl, maxsize=catalog_maxsize)
+        self.image_cache = TTLCache(image_ttl, maxsize=image_maxsize)
+
+    def close(self):
+        self.session.close()
+
+    def invalidate_catalog(self, key=None):
+        self.catalog_cache.invalidate(key)
+
+    def _fetch_access_token(self):
+        data = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'client_credentials',
+        }
 
+        response = self.policies['auth'].call(
+            lambda timeout: observe_http(
+                'moltin',
+                'auth',
+                lambda: self.session.post(
+                    f'{self.base_url}/oauth/access_token',
+                    data=data,
+                    timeout=timeout
+                )
+            )
+        )
+        response.raise_for_status()
 
-def get_headers(client_id, client_secret):
-    global expires_on, access_token
+        access_data = response.json()
 
-    now = time.time()
+        return access_data['access_token'], access_data['expires_in']
 
-    if access_token and now < expires_on:
+    def get_headers(self):
         return {
-            'Authorization': f'Bearer {access_token}',
+            'Authorization': f'Bearer {self.tokens.get_token()}',
             'Content-Type': 'application/json',
         }
 
-    data = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'grant_type': 'client_credentials',
-    }
+    def _send(self, method, url, endpoint, headers, **kwargs):
+        return self.policies[endpoint].call(
+            lambda timeout: observe_http(
+                'moltin',
+                endpoint,
+                lambda: self.session.request(
+                    method, url, headers=headers, timeout=timeout, **kwargs
+                )
+            ),
+            idempotent=method in ('GET', 'PUT', 'DELETE')
+        )
+
+    def _request(self, method, path, endpoint='catalog', **kwargs):
+        memo = get_memo()
+        if not memo:
+            return self._call(method, path, endpoint, **kwargs)
+
+        if method != 'GET':
+            try:
+                return self._call(method, path, endpoint, **kwargs)
+            finally:
+                memo.clear()
+
+        params = kwargs.get('params') or {}
+        key = (self.base_url, path, tuple(sorted(params.items())))
+
+        return memo.get_or_call(
+            key,
+            lambda: self._call(method, path, endpoint, **kwargs)
+        )
+
+    def _call(self, method, path, endpoint, **kwargs):
+        url = f'{self.base_url}{path}'
+        headers = self.get_headers()
+
+        response = self._send(method, url, endpoint, headers, **kwargs)
+
+        if response.status_code == 401:
+            self.tokens.invalidate(headers['Authorization'].split()[-1])
+            response = self._send(
+                method, url, endpoint, self.get_headers(), **kwargs
+            )
+
+        response.raise_for_status()
+
+        return response
+
+    def _get_catalog(self, key, path, params=None):
+        try:
+            return self.catalog_cache.get_or_load(
+                key,
+                lambda: remember_images(
+                    self.image_cache,
+                    self._request('GET', path, params=params).json()
+                )
+            )
+        except Exception as err:
+            return get_stale(self.catalog_cache, key, err)
+
+    def get_products(self):
+        product_data = self._get_catalog(('products',), '/v2/products')
 
-    response = requests.post('https://api.moltin.com/oauth/access_token', data=data)
-    response.raise_for_status()
+        return {
+                product['name']: product['id']
+                for product in product_data['data']
+            }
+
+    def get_product_by_id(self, product_id):
+        return self._get_catalog(
+            ('product', product_id),
+            f'/v2/products/{product_id}',
+            params={'include': 'main_image'}
+        )
+
+    def _fetch_image_url(self, image_id):
+        response = self._request('GET', f'/v2/files/{image_id}')
+
+        return response.json()['data']['link']['href']
+
+    def get_image_url(self, image_id):
+        try:
+            return self.image_cache.get_or_load(
+                image_id,
+                lambda: self._fetch_image_url(image_id)
+            )
+        except Exception as err:
+            return get_stale(self.image_cache, image_id, err)
+
+    def get_image_urls(self, image_ids):
+        image_urls = {}
+        missing_ids = []
+
+        for image_id in dict.fromkeys(image_ids):
+            image_url = self.image_cache.get(image_id)
+
+            if image_url:
+                image_urls[image_id] = image_url
+            else:
+                missing_ids.append(image_id)
+
+        if missing_ids:
+            workers = min(len(missing_ids), self.pool_size)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched_urls = executor.map(self._fetch_image_url, missing_ids)
+
+                for image_id, image_url in zip(missing_ids, fetched_urls):
+                    self.image_cache.set(image_id, image_url)
+                    image_urls[image_id] = image_url
+
+        return image_urls
+
+    def add_product_to_cart(self, cart_id, product_id, quantity):
+        json = {
+            'data':{
+                'id': product_id,
+                'type': 'cart_item',
+                'quantity': quantity
+            }
+        }
 
-    access_data = response.json()
-    access_token = access_data['access_token']
-    expires_on = now + access_data['expires_in']
+        return self._request(
+            'POST',
+            f'/v2/carts/{cart_id}/items',
+            endpoint='cart',
+            json=json
+        ).json()
+
+    def get_cart_and_full_price(self, cart_id):
+        items_info = self._request(
+            'GET',
+            f'/v2/carts/{cart_id}/items',
+            endpoint='cart'
+        ).json()
+
+        return parse_cart(items_info)
+
+    def remove_product_from_cart(self, cart_id, item_id):
+        return self._request(
+            'DELETE',
+            f'/v2/carts/{cart_id}/items/{item_id}',
+            endpoint='cart'
+        ).json()
+
+    def iter_pizzerias(self, page_size=100):
+        offset = 0
+
+        while True:
+            params = {
+                'page[limit]': page_size,
+                'page[offset]': offset,
+            }
+            response = self._request(
+                'GET',
+                '/v2/flows/pizzeria/entries',
+                endpoint='flows',
+                params=params
+            )
+            page = response.json()
+
+            yield from page['data']
+
+            offset += len(page['data'])
+            total = page.get('meta', {}).get('results', {}).get('total')
+
+            if len(page['data']) < page_size or (total and offset >= total):
+                return
+
+    def get_all_pizzerias(self):
+        return list(self.iter_pizzerias())
+
+    def create_customers_address(self, chat_id, latitude, longitude):
+        json = {
+            'data': {
+                'type': 'entry',
+                'customer-id': chat_id,
+                'latitude': latitude,
+                'longitude': longitude
+            }
+        }
 
-    return {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json',
-    }
+        self._request(
+            'POST',
+            '/v2/flows/customer-address/entries',
+            endpoint='flows',
+            json=json
+        )
+
+    def get_deliveryman_id_by_pizzeria_address(self, address):
+        for pizzeria in self.iter_pizzerias():
+            if address == pizzeria['address']:
+                return pizzeria['deliveryman-id']
+
+    def get_products_by_category_id(self, category_id):
+        params = {
+            'filter': f'eq(category.id,{category_id})',
+            'include': 'main_image',
+        }
 
+        return self._get_catalog(
+            ('category_products', category_id),
+            '/v2/products',
+            params=params
+        )
 
-def get_products(client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
+    def get_all_categories(self):
+        return self._get_catalog(('categories',), '/v2/categories')
 
-    response = requests.get('https://api.moltin.com/v2/products', headers=headers)
-    response.raise_for_status()
+    def get_last_category(self):
+        return get_last_category_id(self.get_all_categories())
 
-    product_data = response.json()
 
-    return {
-            product['name']: product['id']
-            for product in product_data['data']
-        }
+def get_last_category_id(categories):
+    category_id = ''
 
+    for category in categories['data']:
+        category_id = category['id']
 
-def get_product_by_id(product_id, client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
+    return category_id
 
-    url = f'https://api.moltin.com/v2/products/{product_id}'
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
 
-    return response.json()
+def get_stale(cache, key, err):
+    """Устаревшее значение из кэша, если Moltin недоступен, иначе err."""
+    value = cache.get_stale(key, _missing)
+    if value is _missing or not is_unavailable(err):
+        raise err
 
+    logger.warning('Moltin недоступен, отдаю устаревшие данные %s: %s', key, err)
 
-def get_image_url(image_id, client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
+    return value
+
+
+def remember_images(image_cache, response_data):
+    included = response_data.get('included', {})
 
-    url = f'https://api.moltin.com/v2/files/{image_id}'
+    for image in included.get('main_images', []):
+        image_cache.set(image['id'], image['link']['href'])
 
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
+    return response_data
 
-    return response.json()['data']['link']['href']
+
+def parse_cart(items_info):
+    return (
+        items_info['data'],
+        items_info['meta']['display_price']['with_tax']['formatted']
+    )
+
+
+def get_client(client_id, client_secret):
+    client = _clients.get((client_id, client_secret))
+
+    if not client:
+        client = MoltinClient(client_id, client_secret)
+        set_client(client)
+
+    return client
+
+
+def set_client(client):
+    _clients[(client.client_id, client.client_secret)] = client
+
+
+def get_headers(client_id, client_secret):
+    return get_client(client_id, client_secret).get_headers()
+
+
+def get_products(client_id, client_secret):
+    return get_client(client_id, client_secret).get_products()
+
+
+def get_product_by_id(product_id, client_id, client_secret):
+    return get_client(client_id, client_secret).get_product_by_id(product_id)
+
+
+def get_image_url(image_id, client_id, client_secret):
+    return get_client(client_id, client_secret).get_image_url(image_id)
+
+
+def get_image_urls(image_ids, client_id, client_secret):
+    return get_client(client_id, client_secret).get_image_urls(image_ids)
 
 
 def add_product_to_cart(
@@ -77,54 +408,29 @@ def add_product_to_cart(
     client_id,
     client_secret
 ):
-    headers = get_headers(client_id, client_secret)
+    client = get_client(client_id, client_secret)
 
-    url = f'https://api.moltin.com/v2/carts/{cart_id}/items'
-
-    json = {
-        'data':{
-            'id': product_id,
-            'type': 'cart_item',
-            'quantity': quantity
-        }
-    }
-
-    response = requests.post(url, headers=headers, json=json)
-    response.raise_for_status()
+    return client.add_product_to_cart(cart_id, product_id, quantity)
 
 
 def get_cart_and_full_price(cart_id, client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
-
-    url = f'https://api.moltin.com/v2/carts/{cart_id}/items'
-
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-
-    items_info = response.json()
-
-    return (
-        items_info['data'], 
-        items_info['meta']['display_price']['with_tax']['formatted']
-    )
+    return get_client(client_id, client_secret).get_cart_and_full_price(cart_id)
 
 
 def remove_product_from_cart(cart_id, item_id, client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
+    client = get_client(client_id, client_secret)
 
-    url = f'https://api.moltin.com/v2/carts/{cart_id}/items/{item_id}'
+    return client.remove_product_from_cart(cart_id, item_id)
 
-    response = requests.delete(url, headers=headers)
-    response.raise_for_status()
 
+def iter_pizzerias(client_id, client_secret, page_size=100):
+    client = get_client(client_id, client_secret)
 
-def get_all_pizzerias(client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
+    return client.iter_pizzerias(page_size=page_size)
 
-    response = requests.get('https://api.moltin.com/v2/flows/pizzeria/entries?page[limit]=100', headers=headers)
-    response.raise_for_status()
 
-    return response.json()['data']
+def get_all_pizzerias(client_id, client_secret):
+    return get_client(client_id, client_secret).get_all_pizzerias()
 
 
 def create_customers_address(
@@ -134,70 +440,26 @@ def create_customers_address(
     latitude,
     longitude
 ):
-    headers = get_headers(client_id, client_secret)
-
-    json = {
-        'data': {
-            'type': 'entry',
-            'customer-id': chat_id,
-            'latitude': latitude,
-            'longitude': longitude
-        }
-    }
+    client = get_client(client_id, client_secret)
 
-    response = requests.post(
-        'https://api.moltin.com/v2/flows/customer-address/entries', 
-        headers=headers, 
-        json=json
-    )
-    response.raise_for_status()
+    return client.create_customers_address(chat_id, latitude, longitude)
 
 
 def get_deliveryman_id_by_pizzeria_address(client_id, client_secret, address):
-    headers = get_headers(client_id, client_secret)
+    client = get_client(client_id, client_secret)
 
-    response = requests.get('https://api.moltin.com/v2/flows/pizzeria/entries?page[limit]=100', headers=headers)
-    response.raise_for_status()
-
-    pizzerias = response.json()
-
-    for pizzeria in pizzerias['data']:
-        if address == pizzeria['address']:
-            return pizzeria['deliveryman-id']
+    return client.get_deliveryman_id_by_pizzeria_address(address)
 
 
 def get_products_by_category_id(client_id, client_secret, category_id):
-    headers = get_headers(client_id, client_secret)
-
-    params = {
-        'filter': f'eq(category.id,{category_id})',
-    }
-
-    response = requests.get('https://api.moltin.com/v2/products', headers=headers, params=params)
-    response.raise_for_status()
+    client = get_client(client_id, client_secret)
 
-    return response.json()
+    return client.get_products_by_category_id(category_id)
 
 
 def get_all_categories(client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
-
-    response = requests.get('https://api.moltin.com/v2/categories', headers=headers)
-    response.raise_for_status()
-
-    return response.json()
+    return get_client(client_id, client_secret).get_all_categories()
 
 
 def get_last_category(client_id, client_secret):
-    headers = get_headers(client_id, client_secret)
-
-    response = requests.get('https://api.moltin.com/v2/categories', headers=headers)
-    response.raise_for_status()
-
-    all_categories = response.json()
-    category_id = ''
-
-    for category in all_categories['data']:
-        category_id = category['id']
-    
-    return category_id
+    return get_client(client_id, client_secret).get_last_category()
@@ -0,0 +1,131 @@
+import json
+import logging
+import threading
+import time
+
+from redis.exceptions import LockError, RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """Выдаёт токен доступа Moltin и обновляет его заранее, одним вызовом.
+
+    Пока один поток обновляет токен, остальные ждут его результата. Если
+    передан redis, токен хранится там и общий для всех процессов на узле,
+    а обновление защищено распределённой блокировкой.
+    """
+
+    def __init__(
+        self,
+        fetch_token,
+        refresh_margin=60,
+        redis=None,
+        redis_key='moltin_access_token',
+        lock_timeout=10
+    ):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.redis = redis
+        self.redis_key = redis_key
+        self.lock_timeout = lock_timeout
+
+        self._lock = threading.Lock()
+        self._current = (None, 0)
+
+    def get_token(self):
+        access_token, expires_on = self._current
+        if self._is_fresh(expires_on):
+            return access_token
+
+        with self._lock:
+            access_token, expires_on = self._current
+            if self._is_fresh(expires_on):
+                return access_token
+
+            if self.redis:
+                self._current = self._get_shared_token()
+            else:
+                self._current = self._refresh()
+
+            return self._current[0]
+
+    def invalidate(self, access_token=None):
+        with self._lock:
+            stale_token = self._current[0]
+            if access_token and access_token != stale_token:
+                return
+
+            self._current = (None, 0)
+
+        if not self.redis:
+            return
+
+        try:
+            shared = self._read_shared()
+            if shared and shared[0] == stale_token:
+                self.redis.delete(self.redis_key)
+        except RedisError as err:
+            logger.warning('Не удалось сбросить токен в Redis: %s', err)
+
+    def _is_fresh(self, expires_on):
+        return time.time() < expires_on - self.refresh_margin
+
+    def _refresh(self):
+        requested_at = time.time()
+        access_token, expires_in = self.fetch_token()
+
+        return access_token, requested_at + expires_in
+
+    def _read_shared(self):
+        raw_token = self.redis.get(self.redis_key)
+        if not raw_token:
+            return None
+
+        token_data = json.loads(raw_token)
+
+        return token_data['access_token'], token_data['expires_on']
+
+    def _write_shared(self, access_token, expires_on):
+        token_data = {
+            'access_token': access_token,
+            'expires_on': expires_on,
+        }
+        ttl = max(int(expires_on - time.time()), 1)
+        self.redis.set(self.redis_key, json.dumps(token_data), ex=ttl)
+
+    def _get_shared_token(self):
+        try:
+            shared = self._read_shared()
+            if shared and self._is_fresh(shared[1]):
+                return shared
+
+            lock = self.redis.lock(
+                f'{self.redis_key}:lock',
+                timeout=self.lock_timeout,
+                blocking_timeout=self.lock_timeout
+            )
+            if not lock.acquire():
+                return self._refresh()
+
+            try:
+                shared = self._read_shared()
+                if shared and self._is_fresh(shared[1]):
+                    return shared
+
+                access_token, expires_on = self._refresh()
+                try:
+                    self._write_shared(access_token, expires_on)
+                except RedisError as err:
+                    logger.warning('Не удалось сохранить токен в Redis: %s', err)
+
+                return access_token, expires_on
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    pass
+        except RedisError as err:
+            logger.warning('Redis недоступен, токен обновлён локально: %s', err)
+
+            return self._refresh()
@@ -0,0 +1,53 @@
+import logging
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoCache:
+    """Запоминает file_id, который Telegram выдал за загруженное фото товара.
+
+    Ключ — id файла картинки в Moltin. Для каждого товара хранится id его
+    текущей картинки: когда главная картинка меняется, file_id старой
+    удаляется. Если Redis недоступен, кэш ничего не знает и ничего не
+    запоминает, а фото отправляется по ссылке.
+    """
+
+    def __init__(
+        self,
+        redis,
+        file_ids_key='telegram_photo_file_ids',
+        product_images_key='telegram_product_images'
+    ):
+        self.redis = redis
+        self.file_ids_key = file_ids_key
+        self.product_images_key = product_images_key
+
+    def get(self, image_id):
+        try:
+            file_id = self.redis.hget(self.file_ids_key, image_id)
+        except RedisError as err:
+            logger.warning('Не удалось прочитать file_id фото из Redis: %s', err)
+            return None
+
+        return file_id.decode('utf-8') if file_id else None
+
+    def remember(self, product_id, image_id, file_id):
+        try:
+            old_image_id = self.redis.hget(self.product_images_key, product_id)
+
+            pipe = self.redis.pipeline()
+            if old_image_id and old_image_id.decode('utf-8') != image_id:
+                pipe.hdel(self.file_ids_key, old_image_id)
+            pipe.hset(self.product_images_key, product_id, image_id)
+            pipe.hset(self.file_ids_key, image_id, file_id)
+            pipe.execute()
+        except RedisError as err:
+            logger.warning('Не удалось сохранить file_id фото в Redis: %s', err)
+
+    def forget(self, image_id):
+        try:
+            self.redis.hdel(self.file_ids_key, image_id)
+        except RedisError as err:
+            logger.warning('Не удалось удалить file_id фото из Redis: %s', err)
@@ -0,0 +1,271 @@
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+
+from geopy import distance
+
+EARTH_RADIUS_KM = 6371.0088
+# Геодезическое расстояние на эллипсоиде отличается от расстояния по сфере
+# меньше чем на 0.5%, поэтому кандидатов добираем с запасом в 1%.
+ELLIPSOID_SLACK = 1.01
+
+logger = logging.getLogger(__name__)
+
+
+def _to_unit_vector(latitude, longitude):
+    latitude = math.radians(float(latitude))
+    longitude = math.radians(float(longitude))
+
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+def _squared_chord(first, second):
+    return sum((a - b) ** 2 for a, b in zip(first, second))
+
+
+def _km_to_squared_chord(km):
+    angle = min(km / EARTH_RADIUS_KM, math.pi)
+
+    return (2 * math.sin(angle / 2)) ** 2
+
+
+def normalize_address(address):
+    return ' '.join(address.lower().split())
+
+
+def get_fingerprint(pizzerias):
+    """Отпечаток всех полей пиццерий.
+
+    Индекс отдаёт записи целиком, вместе с адресом и доставщиком, поэтому
+    изменение любого поля должно его перестроить.
+    """
+    return hash(tuple(sorted(
+        json.dumps(pizzeria, sort_keys=True, default=str)
+        for pizzeria in pizzerias
+    )))
+
+
+class PizzeriaIndex:
+    """KD-дерево пиццерий по координатам на единичной сфере.
+
+    Порядок по длине хорды совпадает с порядком по расстоянию на сфере,
+    поэтому дерево отбирает кандидатов, а точное расстояние считается
+    через geopy только для них.
+    """
+
+    def __init__(self, pizzerias, extra_candidates=8):
+        self.pizzerias = list(pizzerias)
+        self.extra_candidates = extra_candidates
+        self.fingerprint = get_fingerprint(self.pizzerias)
+
+        self.by_id = {pizzeria['id']: pizzeria for pizzeria in self.pizzerias}
+        self.by_address = {
+            normalize_address(pizzeria['address']): pizzeria
+            for pizzeria in self.pizzerias
+        }
+
+        points = [
+            (_to_unit_vector(pizzeria['latitude'], pizzeria['longitude']), number)
+            for number, pizzeria in enumerate(self.pizzerias)
+        ]
+        self._root = self._build(points, depth=0)
+
+    def __len__(self):
+        return len(self.pizzerias)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        vector, number = points[median]
+
+        return (
+            vector,
+            number,
+            axis,
+            self._build(points[:median], depth + 1),
+            self._build(points[median + 1:], depth + 1),
+        )
+
+    def _query_nearest(self, target, count):
+        found = []
+
+        def visit(node):
+            if not node:
+                return
+
+            vector, number, axis, left, right = node
+            squared_chord = _squared_chord(target, vector)
+
+            if len(found) < count:
+                heapq.heappush(found, (-squared_chord, number))
+            elif squared_chord < -found[0][0]:
+                heapq.heapreplace(found, (-squared_chord, number))
+
+            delta = target[axis] - vector[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+
+            if len(found) < count or delta ** 2 < -found[0][0]:
+                visit(far)
+
+        visit(self._root)
+
+        return sorted((-squared_chord, number) for squared_chord, number in found)
+
+    def _query_radius(self, target, squared_radius):
+        found = []
+
+        def visit(node):
+            if not node:
+                return
+
+            vector, number, axis, left, right = node
+            if _squared_chord(target, vector) <= squared_radius:
+                found.append(number)
+
+            delta = target[axis] - vector[axis]
+            if delta < 0 or delta ** 2 <= squared_radius:
+                visit(left)
+            if delta >= 0 or delta ** 2 <= squared_radius:
+                visit(right)
+
+        visit(self._root)
+
+        return found
+
+    def nearest(self, coords, k=1):
+        """Возвращает k ближайших пиццерий как пары (расстояние в км, пиццерия)."""
+        if not self.pizzerias:
+            return []
+
+        target = _to_unit_vector(*coords)
+        candidates = self._query_nearest(target, k + self.extra_candidates)
+        numbers = [number for squared_chord, number in candidates]
+
+        distances = self._measure(coords, numbers)
+        if len(distances) < len(self.pizzerias):
+            squared_radius = _km_to_squared_chord(
+                distances[min(k, len(distances)) - 1][0] * ELLIPSOID_SLACK
+            )
+
+            if candidates[-1][0] <= squared_radius:
+                numbers = self._query_radius(target, squared_radius)
+                distances = self._measure(coords, numbers)
+
+        return [
+            (km, self.pizzerias[number])
+            for km, number in distances[:k]
+        ]
+
+    def _measure(self, coords, numbers):
+        return sorted(
+            (
+                distance.distance(
+                    coords,
+                    (
+                        self.pizzerias[number]['latitude'],
+                        self.pizzerias[number]['longitude'],
+                    )
+                ).km,
+                number,
+            )
+            for number in numbers
+        )
+
+
+class PizzeriaSnapshot:
+    """Снимок пиццерий в памяти, который обновляется раз в refresh_interval.
+
+    Чекаут читает готовый снимок. Обновляет его один поток, остальные
+    в это время пользуются предыдущим снимком, а при ошибке загрузки
+    снимок остаётся прежним. Если пиццерии нет в снимке, он перечитывается
+    досрочно, но не чаще раза в refresh_interval, чтобы устаревшие id
+    не перезагружали список на каждом запросе.
+    """
+
+    def __init__(self, load_pizzerias, refresh_interval=600):
+        self.load_pizzerias = load_pizzerias
+        self.refresh_interval = refresh_interval
+
+        self.index = None
+        self.loaded_at = 0
+        self.forced_at = None
+
+        self._lock = threading.Lock()
+
+    @property
+    def pizzerias(self):
+        return self.get_index().pizzerias
+
+    def nearest(self, coords, k=1):
+        return self.get_index().nearest(coords, k=k)
+
+    def get_pizzeria(self, pizzeria_id=None, address=None):
+        pizzeria = self._lookup(self.get_index(), pizzeria_id, address)
+
+        if not pizzeria and self._can_force_refresh():
+            with self._lock:
+                if self._can_force_refresh():
+                    self.forced_at = time.monotonic()
+                    self.refresh()
+            pizzeria = self._lookup(self.index, pizzeria_id, address)
+
+        return pizzeria
+
+    def _can_force_refresh(self):
+        return (
+            self.forced_at is None
+            or time.monotonic() - self.forced_at >= self.refresh_interval
+        )
+
+    def get_deliveryman_id(self, pizzeria_id=None, address=None):
+        pizzeria = self.get_pizzeria(pizzeria_id, address)
+
+        return pizzeria['deliveryman-id'] if pizzeria else None
+
+    def _lookup(self, index, pizzeria_id, address):
+        if pizzeria_id:
+            return index.by_id.get(pizzeria_id)
+
+        return index.by_address.get(normalize_address(address))
+
+    def get_index(self):
+        if self.index and time.monotonic() - self.loaded_at < self.refresh_interval:
+            return self.index
+
+        if not self._lock.acquire(blocking=not self.index):
+            return self.index
+
+        try:
+            if not self.index or time.monotonic() - self.loaded_at >= self.refresh_interval:
+                self.refresh()
+        finally:
+            self._lock.release()
+
+        return self.index
+
+    def refresh(self):
+        try:
+            pizzerias = list(self.load_pizzerias())
+        except Exception:
+            if not self.index:
+                raise
+            logger.exception('Не удалось обновить список пиццерий')
+            self.loaded_at = time.monotonic()
+            return
+
+        if not self.index or self.index.fingerprint != get_fingerprint(pizzerias):
+            self.index = PizzeriaIndex(pizzerias)
+
+        self.loaded_at = time.monotonic()
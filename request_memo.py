@@ -0,0 +1,62 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+_current_memo = ContextVar('request_memo', default=None)
+
+
+class RequestMemo:
+    """Ответы на GET-запросы в пределах обработки одного события.
+
+    Одинаковый запрос выполняется один раз, остальные получают тот же
+    ответ. Любой изменяющий запрос очищает память, чтобы после него не
+    отдавались старые данные.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.deduplicated = 0
+
+        self._responses = {}
+
+    def get_or_call(self, key, call):
+        self.calls += 1
+
+        if key in self._responses:
+            self.deduplicated += 1
+            return self._responses[key]
+
+        response = call()
+        self._responses[key] = response
+
+        return response
+
+    def clear(self):
+        self._responses.clear()
+
+
+def get_memo():
+    return _current_memo.get()
+
+
+@contextmanager
+def memo_scope(name):
+    memo = RequestMemo(name)
+    token = _current_memo.set(memo)
+
+    try:
+        yield memo
+    finally:
+        _current_memo.reset(token)
+
+        log_level = logging.INFO if memo.deduplicated else logging.DEBUG
+        logger.log(
+            log_level,
+            '%s: повторных GET-запросов %s из %s',
+            memo.name,
+            memo.deduplicated,
+            memo.calls
+        )
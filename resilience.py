@@ -0,0 +1,161 @@
+import logging
+import random
+import threading
+import time
+
+from requests.exceptions import ConnectionError, ConnectTimeout, HTTPError, Timeout
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_unavailable(err):
+    if isinstance(err, (CircuitOpenError, ConnectionError, Timeout)):
+        return True
+
+    return (
+        isinstance(err, HTTPError)
+        and err.response is not None
+        and err.response.status_code >= 500
+    )
+
+
+class CircuitBreaker:
+    """Перестаёт обращаться к сервису после серии ошибок подряд.
+
+    После failure_threshold ошибок вызовы сразу падают с CircuitOpenError.
+    Через reset_timeout секунд пропускается один пробный вызов: если он
+    успешен, цепь снова замыкается.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return
+
+        raise CircuitOpenError(f'{self.name} временно недоступен')
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Цепь %s разомкнута после %s ошибок', self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+
+class CallPolicy:
+    """Таймаут, повторы с экспоненциальной паузой и jitter, circuit breaker.
+
+    Неидемпотентные запросы повторяются, только если соединение не удалось
+    установить, то есть запрос точно не дошёл до сервиса, или если сервис
+    ответил статусом из non_idempotent_retry_statuses. get_retry_after(response)
+    может вернуть паузу, которую попросил сам сервис, вместо случайной.
+    """
+
+    def __init__(
+        self,
+        breaker,
+        timeout=(3.05, 10),
+        retries=2,
+        backoff=0.2,
+        max_backoff=2,
+        retry_statuses=RETRY_STATUSES,
+        non_idempotent_retry_statuses=(),
+        get_retry_after=None
+    ):
+        self.breaker = breaker
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.non_idempotent_retry_statuses = non_idempotent_retry_statuses
+        self.get_retry_after = get_retry_after
+
+    def get_delay(self, attempt, response=None):
+        if response is not None and self.get_retry_after:
+            delay = self.get_retry_after(response)
+            if delay is not None:
+                return delay
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def should_retry(self, response, idempotent):
+        if idempotent:
+            return response.status_code in self.retry_statuses
+
+        return response.status_code in self.non_idempotent_retry_statuses
+
+    def call(self, send, idempotent=True):
+        self.breaker.before_call()
+
+        for attempt in range(self.retries + 1):
+            is_last_attempt = attempt == self.retries
+
+            try:
+                response = send(timeout=self.timeout)
+            except (ConnectionError, Timeout) as err:
+                can_retry = idempotent or isinstance(err, ConnectTimeout)
+                if is_last_attempt or not can_retry:
+                    self.breaker.record_failure()
+                    raise
+                time.sleep(self.get_delay(attempt))
+                continue
+            except Exception:
+                self.breaker.record_failure()
+                raise
+
+            if self.should_retry(response, idempotent) and not is_last_attempt:
+                delay = self.get_delay(attempt, response)
+                logger.warning(
+                    '%s ответил %s, повтор через %.1f с',
+                    self.breaker.name,
+                    response.status_code,
+                    delay
+                )
+                time.sleep(delay)
+                continue
+
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            return response
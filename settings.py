@@ -0,0 +1,130 @@
+import logging
+import signal
+from dataclasses import dataclass
+
+from environs import Env
+
+logger = logging.getLogger(__name__)
+
+_settings = None
+
+
+@dataclass(frozen=True)
+class Settings:
+    client_id: str
+    client_secret: str
+    database_host: str
+    database_port: int
+    database_password: str
+    tg_token: str = None
+    apikey: str = None
+    payment_token: str = None
+    page_access_token: str = None
+    verify_token: str = None
+    fb_app_secret: str = None
+    moltin_api_url: str = 'https://api.moltin.com'
+    graph_api_url: str = 'https://graph.facebook.com'
+    yandex_geocoder_url: str = 'https://geocode-maps.yandex.ru/1.x'
+    tg_api_url: str = None
+    moltin_pool_size: int = 10
+    moltin_timeout: float = 10
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: int = 30
+    catalog_ttl: int = 300
+    cart_ttl: int = 600
+    pizzerias_refresh_interval: int = 600
+    geocode_ttl: int = 30 * 24 * 3600
+    geocode_negative_ttl: int = 24 * 3600
+    fb_pool_size: int = 10
+    fb_event_shards: int = 8
+    fb_event_poll_timeout: int = 5
+    menu_ttl: int = 3600
+    state_ttl: int = 7 * 24 * 3600
+    dispatch_mode: str = 'inline'
+    dispatch_workers: int = 8
+    dispatch_queue_size: int = 0
+    dispatch_stats_interval: int = 0
+    tg_mode: str = 'polling'
+    tg_webhook_url: str = None
+    tg_webhook_secret: str = None
+    tg_update_shards: int = 8
+    tg_worker_index: int = 0
+    tg_worker_count: int = 1
+    metrics_port: int = 0
+
+
+def load_settings(path=None):
+    env = Env()
+    env.read_env(path)
+
+    return Settings(
+        client_id=env('CLIENT_ID'),
+        client_secret=env('CLIENT_SECRET'),
+        database_host=env('REDIS_HOST'),
+        database_port=env.int('REDIS_PORT'),
+        database_password=env('REDIS_PASSWORD', None),
+        tg_token=env('TELEGRAM_TOKEN', None),
+        apikey=env('YANDEX_API', None),
+        payment_token=env('PAYMENT_PROVIDER_TOKEN', None),
+        page_access_token=env('PAGE_ACCESS_TOKEN', None),
+        verify_token=env('VERIFY_TOKEN', None),
+        fb_app_secret=env('FB_APP_SECRET', None),
+        moltin_api_url=env('MOLTIN_API_URL', 'https://api.moltin.com'),
+        graph_api_url=env('GRAPH_API_URL', 'https://graph.facebook.com'),
+        yandex_geocoder_url=env('YANDEX_GEOCODER_URL', 'https://geocode-maps.yandex.ru/1.x'),
+        tg_api_url=env('TELEGRAM_API_URL', None),
+        moltin_pool_size=env.int('MOLTIN_POOL_SIZE', 10),
+        moltin_timeout=env.float('MOLTIN_TIMEOUT', 10),
+        circuit_failure_threshold=env.int('CIRCUIT_FAILURE_THRESHOLD', 5),
+        circuit_reset_timeout=env.int('CIRCUIT_RESET_TIMEOUT', 30),
+        catalog_ttl=env.int('CATALOG_TTL', 300),
+        cart_ttl=env.int('CART_TTL', 600),
+        pizzerias_refresh_interval=env.int('PIZZERIAS_REFRESH_INTERVAL', 600),
+        geocode_ttl=env.int('GEOCODE_TTL', 30 * 24 * 3600),
+        geocode_negative_ttl=env.int('GEOCODE_NEGATIVE_TTL', 24 * 3600),
+        fb_pool_size=env.int('FB_POOL_SIZE', 10),
+        fb_event_shards=env.int('FB_EVENT_SHARDS', 8),
+        fb_event_poll_timeout=env.int('FB_EVENT_POLL_TIMEOUT', 5),
+        menu_ttl=env.int('MENU_TTL', 3600),
+        state_ttl=env.int('STATE_TTL', 7 * 24 * 3600),
+        dispatch_mode=env('DISPATCH_MODE', 'inline'),
+        dispatch_workers=env.int('DISPATCH_WORKERS', 8),
+        dispatch_queue_size=env.int('DISPATCH_QUEUE_SIZE', 0),
+        dispatch_stats_interval=env.int('DISPATCH_STATS_INTERVAL', 0),
+        tg_mode=env('TELEGRAM_MODE', 'polling'),
+        tg_webhook_url=env('TELEGRAM_WEBHOOK_URL', None),
+        tg_webhook_secret=env('TELEGRAM_WEBHOOK_SECRET', None),
+        tg_update_shards=env.int('TELEGRAM_UPDATE_SHARDS', 8),
+        tg_worker_index=env.int('TELEGRAM_WORKER_INDEX', 0),
+        tg_worker_count=env.int('TELEGRAM_WORKER_COUNT', 1),
+        metrics_port=env.int('METRICS_PORT', 0),
+    )
+
+
+def get_settings():
+    global _settings
+    if not _settings:
+        _settings = load_settings()
+    return _settings
+
+
+def reload_settings():
+    global _settings
+    _settings = load_settings()
+    return _settings
+
+
+def reload_on_sighup(on_reload=None):
+    """Перечитывает настройки по SIGHUP и передаёт новые в on_reload."""
+    def handle_sighup(signum, frame):
+        try:
+            settings = reload_settings()
+        except Exception:
+            logger.exception('Не удалось перечитать настройки, оставлены прежние')
+            return
+
+        logger.info('Настройки перечитаны')
+        if on_reload:
+            on_reload(settings)
+
+    signal.signal(signal.SIGHUP, handle_sighup)
@@ -0,0 +1,75 @@
+import json
+from collections import namedtuple
+
+UserState = namedtuple('UserState', ['state', 'data', 'version'])
+
+SAVE_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], 'version') or '0'
+if ARGV[1] ~= '' and version ~= ARGV[1] then
+    return -1
+end
+local new_version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[1], 'state', ARGV[2], 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return new_version
+"""
+
+
+class StaleStateError(Exception):
+    pass
+
+
+class StateStore:
+    """Состояние диалога и данные сессии пользователя в одном хэше Redis.
+
+    Загрузка и сохранение занимают по одному запросу к Redis, каждое
+    обращение продлевает время жизни ключа. Сохранение проверяет версию,
+    прочитанную при загрузке, и не затирает более новое состояние.
+    """
+
+    def __init__(self, redis, prefix, ttl=7 * 24 * 3600):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self._save_script = redis.register_script(SAVE_SCRIPT)
+
+    def get_key(self, user_id):
+        return f'{self.prefix}{user_id}'
+
+    def load(self, user_id):
+        key = self.get_key(user_id)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.expire(key, self.ttl)
+        fields, _ = pipe.execute()
+
+        state = fields.get(b'state')
+        data = fields.get(b'data')
+
+        return UserState(
+            state=state.decode('utf-8') if state else None,
+            data=json.loads(data) if data else {},
+            version=int(fields.get(b'version', 0)),
+        )
+
+    def save(self, user_id, state, data=None, version=None):
+        new_version = self._save_script(
+            keys=[self.get_key(user_id)],
+            args=[
+                '' if version is None else version,
+                state,
+                json.dumps(data or {}),
+                self.ttl,
+            ]
+        )
+
+        if new_version == -1:
+            raise StaleStateError(
+                f'Состояние пользователя {user_id} изменилось после загрузки'
+            )
+
+        return new_version
+
+    def delete(self, user_id):
+        self.redis.delete(self.get_key(user_id))
@@ -0,0 +1,101 @@
+import pytest
+from requests import HTTPError, ReadTimeout, Response
+
+from cart_service import CartService
+
+
+def get_items_info(items):
+    full_price = sum(item['price'] for item in items)
+
+    return {
+        'data': list(items),
+        'meta': {'display_price': {'with_tax': {'formatted': str(full_price)}}},
+    }
+
+
+class FakeMoltin:
+    """Корзины Moltin в памяти.
+
+    Если задан fail_with, следующее изменение применяется к корзине, но
+    вызывающий получает эту ошибку, как при таймауте ответа.
+    """
+
+    def __init__(self):
+        self.carts = {}
+        self.fail_with = None
+        self.reads = 0
+
+    def _apply(self, items_info):
+        if self.fail_with:
+            err, self.fail_with = self.fail_with, None
+            raise err
+        return items_info
+
+    def add_product_to_cart(self, cart_id, product_id, quantity):
+        items = self.carts.setdefault(cart_id, [])
+        items.append({'id': f'item-{product_id}', 'product_id': product_id, 'price': 100})
+        return self._apply(get_items_info(items))
+
+    def remove_product_from_cart(self, cart_id, item_id):
+        items = self.carts.setdefault(cart_id, [])
+        if not any(item['id'] == item_id for item in items):
+            response = Response()
+            response.status_code = 404
+            raise HTTPError(response=response)
+        items[:] = [item for item in items if item['id'] != item_id]
+        return self._apply(get_items_info(items))
+
+    def get_cart_and_full_price(self, cart_id):
+        self.reads += 1
+        items_info = get_items_info(self.carts.get(cart_id, []))
+        return items_info['data'], items_info['meta']['display_price']['with_tax']['formatted']
+
+
+@pytest.fixture
+def moltin():
+    return FakeMoltin()
+
+
+def test_mutations_update_local_copy_without_reads(moltin):
+    carts = CartService(moltin)
+
+    carts.add('cart', 'p1', 1)
+    carts.add('cart', 'p2', 1)
+    cart = carts.remove('cart', 'item-p1')
+
+    assert cart.full_price == '100'
+    assert carts.get('cart') == cart
+    assert moltin.reads == 0
+
+
+def test_timed_out_add_resyncs_cart(moltin):
+    carts = CartService(moltin)
+    assert carts.get('cart').full_price == '0'
+
+    moltin.fail_with = ReadTimeout()
+    with pytest.raises(ReadTimeout):
+        carts.add('cart', 'p1', 1)
+
+    cart = carts.get('cart')
+
+    assert cart.full_price == '100'
+    assert len(cart.items) == 1
+
+
+def test_timed_out_remove_resyncs_cart(moltin):
+    carts = CartService(moltin)
+    carts.add('cart', 'p1', 1)
+
+    moltin.fail_with = ReadTimeout()
+    with pytest.raises(ReadTimeout):
+        carts.remove('cart', 'item-p1')
+
+    assert carts.get('cart').items == []
+
+
+def test_remove_of_missing_item_resyncs_cart(moltin):
+    carts = CartService(moltin)
+    carts.add('cart', 'p1', 1)
+    moltin.carts['cart'].clear()
+
+    assert carts.remove('cart', 'item-p1').items == []
@@ -0,0 +1,24 @@
+import fakeredis
+
+from photo_cache import PhotoCache
+
+
+def test_remember_replaces_old_image():
+    photos = PhotoCache(fakeredis.FakeRedis())
+
+    photos.remember('product', 'image-1', 'file-1')
+    photos.remember('product', 'image-2', 'file-2')
+
+    assert photos.get('image-1') is None
+    assert photos.get('image-2') == 'file-2'
+
+
+def test_unavailable_redis_is_a_cache_miss():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    photos = PhotoCache(fakeredis.FakeRedis(server=server))
+
+    photos.remember('product', 'image', 'file')
+    photos.forget('image')
+
+    assert photos.get('image') is None
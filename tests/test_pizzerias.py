@@ -0,0 +1,109 @@
+import random
+
+import pytest
+from geopy import distance
+
+from pizzerias import PizzeriaIndex, PizzeriaSnapshot, _to_unit_vector
+
+
+def generate_pizzerias(count, rng):
+    return [
+        {
+            'id': f'pizzeria-{number}',
+            'address': f'Адрес {number}',
+            'latitude': rng.uniform(55.45, 56.05),
+            'longitude': rng.uniform(37.25, 37.95),
+            'deliveryman-id': number,
+        }
+        for number in range(count)
+    ]
+
+
+def find_nearest_by_loop(coords, pizzerias, k):
+    distances = sorted(
+        (
+            distance.distance(
+                coords,
+                (pizzeria['latitude'], pizzeria['longitude'])
+            ).km,
+            pizzeria['id'],
+        )
+        for pizzeria in pizzerias
+    )
+
+    return distances[:k]
+
+
+def get_ids_and_distances(nearest):
+    return [(km, pizzeria['id']) for km, pizzeria in nearest]
+
+
+@pytest.mark.parametrize('k', [1, 3, 10])
+@pytest.mark.parametrize('extra_candidates', [0, 8])
+def test_nearest_matches_loop(k, extra_candidates):
+    rng = random.Random(k)
+    pizzerias = generate_pizzerias(200, rng)
+    index = PizzeriaIndex(pizzerias, extra_candidates=extra_candidates)
+
+    for _ in range(20):
+        coords = (rng.uniform(55.3, 56.2), rng.uniform(37.1, 38.1))
+
+        assert get_ids_and_distances(index.nearest(coords, k=k)) == pytest.approx(
+            find_nearest_by_loop(coords, pizzerias, k)
+        )
+
+
+def test_nearest_falls_back_to_radius_when_ellipsoid_reorders():
+    # На сфере восточная пиццерия ближе северной, на эллипсоиде — наоборот.
+    north = {'id': 'north', 'address': 'Север', 'latitude': 46, 'longitude': 37}
+    east = {'id': 'east', 'address': 'Восток', 'latitude': 45, 'longitude': 38.4135}
+    index = PizzeriaIndex([north, east], extra_candidates=0)
+
+    [(_, number)] = index._query_nearest(_to_unit_vector(45, 37), 1)
+    assert index.pizzerias[number]['id'] == 'east'
+
+    [(km, pizzeria)] = index.nearest((45, 37))
+
+    assert pizzeria['id'] == 'north'
+    assert km == pytest.approx(distance.distance((45, 37), (46, 37)).km)
+
+
+def test_nearest_returns_everything_when_k_exceeds_size():
+    pizzerias = generate_pizzerias(5, random.Random(1))
+    index = PizzeriaIndex(pizzerias)
+
+    nearest = index.nearest((55.75, 37.6), k=10)
+
+    assert len(nearest) == 5
+    assert get_ids_and_distances(nearest) == pytest.approx(
+        find_nearest_by_loop((55.75, 37.6), pizzerias, 10)
+    )
+
+
+def test_nearest_in_empty_index():
+    assert PizzeriaIndex([]).nearest((55.75, 37.6)) == []
+
+
+def test_snapshot_forces_reload_at_most_once_per_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('pizzerias.time.monotonic', lambda: now[0])
+    loads = []
+
+    def load_pizzerias():
+        loads.append(now[0])
+        return generate_pizzerias(3, random.Random(0))
+
+    snapshot = PizzeriaSnapshot(load_pizzerias, refresh_interval=600)
+
+    assert snapshot.get_deliveryman_id(pizzeria_id='pizzeria-1') == 1
+    assert snapshot.get_deliveryman_id(pizzeria_id='missing') is None
+    assert snapshot.get_deliveryman_id(pizzeria_id='missing') is None
+    assert len(loads) == 2
+
+    now[0] += 599
+    assert snapshot.get_deliveryman_id(pizzeria_id='missing') is None
+    assert len(loads) == 2
+
+    now[0] += 1
+    assert snapshot.get_deliveryman_id(pizzeria_id='missing') is None
+    assert len(loads) > 2
@@ -0,0 +1,138 @@
+import pytest
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+
+from resilience import CallPolicy, CircuitBreaker, CircuitOpenError
+
+
+class Response:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def wait_reset_timeout(breaker):
+    breaker.opened_at -= breaker.reset_timeout
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+
+
+def test_breaker_opens_after_threshold(breaker):
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_success_closes(breaker):
+    open_breaker(breaker)
+    wait_reset_timeout(breaker)
+    assert breaker.state == 'half-open'
+
+    breaker.before_call()
+    breaker.record_success()
+
+    assert breaker.state == 'closed'
+    breaker.before_call()
+
+
+def test_half_open_failure_opens_again(breaker):
+    open_breaker(breaker)
+    wait_reset_timeout(breaker)
+
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_lets_one_trial_through(breaker):
+    open_breaker(breaker)
+    wait_reset_timeout(breaker)
+
+    breaker.before_call()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_policy_retries_connection_errors(breaker):
+    policy = CallPolicy(breaker, retries=2, backoff=0)
+    responses = iter([ConnectionError(), Response(503), Response(200)])
+
+    def send(timeout):
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert policy.call(send).status_code == 200
+    assert breaker.failures == 0
+
+
+def test_policy_does_not_retry_non_idempotent_after_send(breaker):
+    policy = CallPolicy(breaker, retries=2, backoff=0)
+    calls = []
+
+    def send(timeout):
+        calls.append(timeout)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        policy.call(send, idempotent=False)
+
+    assert len(calls) == 1
+
+
+def test_unexpected_error_in_trial_does_not_stick_circuit(breaker):
+    policy = CallPolicy(breaker, retries=0)
+    open_breaker(breaker)
+    wait_reset_timeout(breaker)
+
+    def send(timeout):
+        raise ChunkedEncodingError()
+
+    with pytest.raises(ChunkedEncodingError):
+        policy.call(send)
+
+    assert breaker.state == 'open'
+
+    wait_reset_timeout(breaker)
+    assert policy.call(lambda timeout: Response(200)).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def test_policy_takes_delay_from_retry_after_hook(breaker, monkeypatch):
+    delays = []
+    monkeypatch.setattr('resilience.time.sleep', delays.append)
+    policy = CallPolicy(
+        breaker,
+        retries=2,
+        non_idempotent_retry_statuses=(429,),
+        get_retry_after=lambda response: 7 if response.status_code == 429 else None
+    )
+    responses = iter([Response(429), Response(200)])
+
+    assert policy.call(lambda timeout: next(responses), idempotent=False).status_code == 200
+    assert delays == [7]
+
+
+def test_policy_does_not_retry_non_idempotent_5xx_by_default(breaker):
+    policy = CallPolicy(breaker, retries=2, backoff=0)
+    responses = iter([Response(503), Response(200)])
+
+    assert policy.call(lambda timeout: next(responses), idempotent=False).status_code == 503
@@ -0,0 +1,55 @@
+import fakeredis
+import pytest
+
+from state_store import StaleStateError, StateStore
+
+
+@pytest.fixture
+def states():
+    return StateStore(fakeredis.FakeRedis(), 'test_state_', ttl=60)
+
+
+def test_load_missing_user(states):
+    user_state = states.load(1)
+
+    assert user_state.state is None
+    assert user_state.data == {}
+    assert user_state.version == 0
+
+
+def test_save_and_load(states):
+    assert states.save(1, 'HANDLE_MENU', {'pizzeria_id': 'p1'}, version=0) == 1
+
+    user_state = states.load(1)
+
+    assert user_state.state == 'HANDLE_MENU'
+    assert user_state.data == {'pizzeria_id': 'p1'}
+    assert user_state.version == 1
+    assert 0 < states.redis.ttl('test_state_1') <= 60
+
+
+def test_save_with_stale_version_keeps_newer_state(states):
+    first = states.load(1)
+    second = states.load(1)
+
+    states.save(1, 'HANDLE_CART', version=first.version)
+
+    with pytest.raises(StaleStateError):
+        states.save(1, 'HANDLE_MENU', version=second.version)
+
+    assert states.load(1).state == 'HANDLE_CART'
+    assert states.load(1).version == 1
+
+
+def test_save_without_version_overwrites(states):
+    states.save(1, 'HANDLE_CART', version=0)
+
+    assert states.save(1, 'START') == 2
+    assert states.load(1).state == 'START'
+
+
+def test_delete(states):
+    states.save(1, 'HANDLE_CART', version=0)
+    states.delete(1)
+
+    assert states.load(1).state is None
@@ -0,0 +1,62 @@
+import hmac
+
+from flask import Flask, request
+
+from metrics import InstrumentedRedis
+from settings import get_settings
+from update_queue import ShardedQueue
+
+app = Flask(__name__)
+
+
+def get_updates_queue(config):
+    if not config.get('updates'):
+        settings = get_settings()
+        config.update(
+            updates=ShardedQueue(
+                InstrumentedRedis(
+                    host=settings.database_host,
+                    port=settings.database_port,
+                    password=settings.database_password,
+                ),
+                'tg_updates',
+                shards=settings.tg_update_shards,
+            )
+        )
+
+    return config['updates']
+
+
+def get_update_chat_id(update):
+    for field in ('message', 'edited_message', 'channel_post'):
+        if update.get(field):
+            return update[field]['chat']['id']
+
+    callback_query = update.get('callback_query')
+    if callback_query and callback_query.get('message'):
+        return callback_query['message']['chat']['id']
+
+    for field in ('callback_query', 'pre_checkout_query', 'shipping_query', 'inline_query'):
+        if update.get(field):
+            return update[field]['from']['id']
+
+    return update.get('update_id')
+
+
+@app.route('/telegram', methods=['POST'])
+def webhook():
+    """
+    Telegram присылает сюда обновления, они кладутся в очередь для процессов bot.py.
+    """
+    secret = get_settings().tg_webhook_secret
+    received_secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not secret or not hmac.compare_digest(secret, received_secret):
+        return "Invalid secret token", 403
+
+    update = request.get_json(silent=True)
+    if not update or 'update_id' not in update:
+        return "Bad update", 400
+
+    get_updates_queue(app.config).push(get_update_chat_id(update), update)
+
+    return "ok", 200
@@ -0,0 +1,88 @@
+import json
+import logging
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedQueue:
+    """Очередь событий в Redis, разбитая на шарды по ключу пользователя.
+
+    События одного пользователя всегда попадают в один шард, а каждый шард
+    читает ровно один поток, поэтому порядок для пользователя сохраняется,
+    а разные пользователи обрабатываются параллельно.
+    """
+
+    def __init__(self, redis, name, shards=8):
+        self.redis = redis
+        self.name = name
+        self.shards = shards
+
+    def shard_for(self, key):
+        return zlib.crc32(str(key).encode()) % self.shards
+
+    def get_shard_key(self, shard):
+        return f'{self.name}:{shard}'
+
+    def push(self, key, payload):
+        self.push_many([(key, payload)])
+
+    def push_many(self, events):
+        if not events:
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        for key, payload in events:
+            pipe.rpush(self.get_shard_key(self.shard_for(key)), json.dumps(payload))
+        pipe.execute()
+
+    def pop(self, shard, timeout=5):
+        item = self.redis.blpop(self.get_shard_key(shard), timeout=timeout)
+        if not item:
+            return None
+
+        return json.loads(item[1])
+
+    def depth(self):
+        pipe = self.redis.pipeline(transaction=False)
+        for shard in range(self.shards):
+            pipe.llen(self.get_shard_key(shard))
+
+        return dict(enumerate(pipe.execute()))
+
+
+def consume(queue, shards, handle_event, stop_event=None, timeout=5):
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    def consume_shard(shard):
+        while not stop_event.is_set():
+            try:
+                event = queue.pop(shard, timeout=timeout)
+            except Exception:
+                logger.exception('Не удалось прочитать шард %s', shard)
+                stop_event.wait(timeout)
+                continue
+
+            if event is None:
+                continue
+
+            try:
+                handle_event(event)
+            except Exception:
+                logger.exception('Ошибка при обработке события %s', event)
+
+    threads = [
+        threading.Thread(
+            target=consume_shard,
+            args=(shard,),
+            name=f'{queue.name}-{shard}',
+            daemon=True
+        )
+        for shard in shards
+    ]
+    for thread in threads:
+        thread.start()
+
+    return threads
@@ -1,13 +1,55 @@
+import json
+import logging
+import re
+import threading
+import time
+
 import requests
+from redis.exceptions import RedisError
+
+from caching import TTLCache
+from metrics import observe_http
+from resilience import CallPolicy, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+ABBREVIATIONS = {
+    'г': 'город',
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'д': 'дом',
+    'корп': 'корпус',
+    'к': 'корпус',
+    'стр': 'строение',
+}
+
+GEOCODER_URL = "https://geocode-maps.yandex.ru/1.x"
 
+_missing = object()
+_policy = CallPolicy(CircuitBreaker('yandex'), timeout=(3.05, 5), retries=1)
 
-def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url, params={
-        "geocode": address,
-        "apikey": apikey,
-        "format": "json",
-    })
+
+def fetch_coordinates(apikey, address, policy=None, base_url=GEOCODER_URL):
+    policy = policy or _policy
+    response = policy.call(
+        lambda timeout: observe_http('yandex', 'geocode', lambda: requests.get(
+            base_url,
+            params={
+                "geocode": address,
+                "apikey": apikey,
+                "format": "json",
+            },
+            timeout=timeout
+        ))
+    )
     response.raise_for_status()
     found_places = response.json()['response']['GeoObjectCollection']['featureMember']
 
@@ -16,4 +58,132 @@ def fetch_coordinates(apikey, address):
 
     most_relevant = found_places[0]
     lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-    return float(lat), float(lon)
\ No newline at end of file
+    return float(lat), float(lon)
+
+
+def normalize_address(address):
+    words = re.findall(r'\w+(?:-\w+)*', address.lower().replace('ё', 'е'))
+
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+class GeocoderCache:
+    """Кэш геокодера: LRU в памяти процесса перед общим кэшем в Redis.
+
+    Найденные и ненайденные адреса хранятся с разным временем жизни.
+    """
+
+    def __init__(
+        self,
+        apikey,
+        redis=None,
+        positive_ttl=30 * 24 * 3600,
+        negative_ttl=24 * 3600,
+        local_maxsize=1024,
+        key_prefix='geocode:',
+        policy=None,
+        base_url=GEOCODER_URL
+    ):
+        self.apikey = apikey
+        self.base_url = base_url
+        self.policy = policy
+        self.redis = redis
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.key_prefix = key_prefix
+
+        self.local = TTLCache(positive_ttl, maxsize=local_maxsize)
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.fetch_seconds = 0
+
+        self._lock = threading.Lock()
+
+    def fetch_coordinates(self, address):
+        key = normalize_address(address)
+
+        coords = self.local.get(key, _missing)
+        if coords is not _missing:
+            self._count('local_hits')
+            return coords
+
+        coords = self._read_redis(key)
+        if coords is not _missing:
+            self._count('redis_hits')
+            self._remember_locally(key, coords)
+            return coords
+
+        started_at = time.perf_counter()
+        coords = fetch_coordinates(
+            self.apikey,
+            address,
+            policy=self.policy,
+            base_url=self.base_url
+        )
+
+        with self._lock:
+            self.misses += 1
+            self.fetch_seconds += time.perf_counter() - started_at
+
+        self._remember_locally(key, coords)
+        self._write_redis(key, coords)
+
+        return coords
+
+    def stats(self):
+        with self._lock:
+            hits = self.local_hits + self.redis_hits
+            requests_count = hits + self.misses
+            average_fetch = self.fetch_seconds / self.misses if self.misses else 0
+
+            return {
+                'hits': hits,
+                'local_hits': self.local_hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'hit_ratio': hits / requests_count if requests_count else 0,
+                'average_fetch_seconds': average_fetch,
+                'saved_seconds': hits * average_fetch,
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _ttl(self, coords):
+        return self.positive_ttl if coords else self.negative_ttl
+
+    def _remember_locally(self, key, coords):
+        self.local.set(key, coords, ttl=self._ttl(coords))
+
+    def _read_redis(self, key):
+        if not self.redis:
+            return _missing
+
+        try:
+            raw_coords = self.redis.get(f'{self.key_prefix}{key}')
+        except RedisError as err:
+            logger.warning('Не удалось прочитать кэш геокодера: %s', err)
+            return _missing
+
+        if raw_coords is None:
+            return _missing
+
+        coords = json.loads(raw_coords)
+
+        return tuple(coords) if coords else None
+
+    def _write_redis(self, key, coords):
+        if not self.redis:
+            return
+
+        try:
+            self.redis.set(
+                f'{self.key_prefix}{key}',
+                json.dumps(coords),
+                ex=self._ttl(coords)
+            )
+        except RedisError as err:
+            logger.warning('Не удалось сохранить кэш геокодера: %s', err)